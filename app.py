@@ -1,14 +1,24 @@
+# Record the import-time breakdown of this process before anything else loads.
+from utils import startup_timing
+startup_timing.install()
+
+import io
+import uuid
 import streamlit as st
-import pandas as pd
-from sqlalchemy import text
-from config import database
-from models import query_processor
-from utils import helpers
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from config import database, settings
+from models import entity_gazetteer, query_cache, query_executor, query_processor, result_cache, single_flight, warmup
+from utils import embedding_provider, helpers, tracing
 
 # --- Helper function for CSV download ---
+# Keyed by an id given to each result when it is stored; the table itself
+# (leading underscore) is not hashed, which would mean serializing it on every rerun.
 @st.cache_data
-def convert_df_to_csv(df):
-    return df.to_csv(index=False).encode('utf-8')
+def convert_table_to_csv(result_id, _table):
+    buffer = io.BytesIO()
+    pa_csv.write_csv(_table, buffer)
+    return buffer.getvalue()
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="NL-to-SQL", page_icon="🤖", layout="wide")
@@ -30,6 +40,25 @@ with st.sidebar:
         - **Sentence Transformers**: For creating vector embeddings.
         - **PostgreSQL with pgvector**: For hybrid search capabilities.
     """)
+    st.write("---")
+    with st.expander("Connection Pool"):
+        st.json(database.get_pool_stats())
+    with st.expander("Query Cache"):
+        st.json(query_cache.get_stats())
+    with st.expander("Entity Pre-filter"):
+        st.json(entity_gazetteer.get_stats())
+    with st.expander("Result Cache"):
+        st.json(result_cache.get_stats())
+    with st.expander("Request Coalescing"):
+        st.json(single_flight.get_stats())
+    with st.expander("Embeddings"):
+        st.json(embedding_provider.get_stats())
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        with st.expander("Local Vector Index"):
+            from models import local_vector_index
+            st.json(local_vector_index.get_stats())
+    with st.expander("Startup Timing"):
+        st.json(startup_timing.get_report())
 
 # --- MAIN PAGE ---
 st.title("🤖 Natural Language Search for Your Database")
@@ -37,6 +66,8 @@ st.write("""
     Ask a question in plain English, and the system will translate it into a SQL query, 
     which will be used to retrieve data from the database.
 """)
+if not settings.OPENAI_API_KEY:
+    st.error("No OpenAI API key found. Set OPENAI_API_KEY in your .env file.")
 st.write("---")
 st.markdown("#### Example Questions:")
 col1, col2, col3 = st.columns(3)
@@ -51,11 +82,17 @@ with col3:
         st.session_state.user_question = "Show order totals by date for the last 10 orders"
 st.write("---")
 
+# The page skeleton is on screen; load the heavy subsystems in the background
+# (once per process) so the first question doesn't pay for them.
+warmup.start_background_warmup()
+if settings.METRICS_PORT:
+    tracing.start_metrics_server(settings.METRICS_PORT)
+
 # --- SESSION STATE INITIALIZATION ---
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-if 'latest_df' not in st.session_state:
-    st.session_state.latest_df = None
+if 'latest_table' not in st.session_state:
+    st.session_state.latest_table = None
 if 'user_question' not in st.session_state:
     st.session_state.user_question = ""
 if 'chart_visible' not in st.session_state:
@@ -64,7 +101,7 @@ if 'chart_visible' not in st.session_state:
 # Display chat history
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
-        if isinstance(message["content"], pd.DataFrame):
+        if isinstance(message["content"], pa.Table):
             st.dataframe(message["content"])
         else:
             st.markdown(message["content"], unsafe_allow_html=True)
@@ -82,48 +119,80 @@ if st.session_state.user_question:
         st.markdown(st.session_state.user_question)
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            sql_query = query_processor.process_natural_language_query(st.session_state.user_question)
+        with st.spinner("Thinking..."), tracing.trace("question") as request_trace:
+            if settings.ASYNC_PIPELINE_ENABLED:
+                from models import async_query_processor
+                sql_query = async_query_processor.run_query(st.session_state.user_question)
+            elif settings.STREAM_SQL_GENERATION:
+                sql_placeholder = st.empty()
+                sql_query = query_processor.process_natural_language_query(
+                    st.session_state.user_question,
+                    on_partial_sql=lambda partial: sql_placeholder.code(
+                        helpers.extract_sql_from_response(partial), language="sql"
+                    ),
+                )
+                sql_placeholder.empty()
+            else:
+                sql_query = query_processor.process_natural_language_query(st.session_state.user_question)
 
             with st.expander("View Generated SQL"):
                 st.code(sql_query, language="sql")
             
             if "error" in sql_query.lower():
+                tracing.annotate(status="error")
                 st.error(sql_query)
                 st.session_state.messages.append({"role": "assistant", "content": sql_query})
             else:
                 try:
-                    engine = database.get_db_engine()
-                    with engine.connect() as connection:
-                        df = pd.read_sql_query(text(sql_query), connection)
-
-                    st.success("Query executed successfully!")
-                    
-                    embedding_cols = [col for col in df.columns if 'embedding' in col]
-                    df_display = df.drop(columns=embedding_cols)
-                    
-                    st.dataframe(df_display)
-                    st.session_state.latest_df = df_display
-                    st.session_state.messages.append({"role": "assistant", "content": df_display})
+                    # Show the first page as soon as it arrives, then the full result.
+                    result_placeholder = st.empty()
+                    table, cost_warnings, from_cache = query_executor.execute_query(
+                        sql_query, on_first_page=result_placeholder.dataframe
+                    )
+                    with tracing.span("render", rows=table.num_rows):
+                        result_placeholder.dataframe(table)
+
+                    st.success(
+                        f"Query executed successfully! ({table.num_rows} rows{', cached' if from_cache else ''})"
+                    )
+                    for warning in cost_warnings:
+                        st.warning(f"Cost guard: {warning}")
+
+                    # The history references the same Arrow buffers (slices are zero-copy).
+                    st.session_state.latest_table = table
+                    st.session_state.latest_table_id = uuid.uuid4().hex
+                    st.session_state.messages.append(
+                        {"role": "assistant", "content": table.slice(0, settings.RESULT_FIRST_PAGE_ROWS)}
+                    )
 
                 except Exception as e:
+                    tracing.annotate(status="error")
                     st.error(f"An error occurred: {e}")
                     st.session_state.messages.append({"role": "assistant", "content": f"Error: {e}"})
+
+        with st.expander("View Trace"):
+            st.json(request_trace.to_dict())
     
     # Store the question that generated the latest dataframe for context
     st.session_state.latest_query = st.session_state.user_question
     st.session_state.user_question = ""
 
 # Display buttons and chart if there's a recent result
-if st.session_state.latest_df is not None:
+if st.session_state.latest_table is not None:
     st.write("---")
     col1, col2 = st.columns(2)
     with col1:
-        csv = convert_df_to_csv(st.session_state.latest_df)
+        csv = convert_table_to_csv(st.session_state.latest_table_id, st.session_state.latest_table)
         st.download_button(label="📥 Download as CSV", data=csv, file_name='query_results.csv', mime='text/csv')
     with col2:
         if st.button("📊 Build Chart"):
             st.session_state.chart_visible = not st.session_state.chart_visible
 
     if st.session_state.chart_visible:
-        helpers.display_intelligent_chart(st.session_state.latest_df, st.session_state.latest_query)
+        # Converted once per result rather than on every rerun.
+        if st.session_state.get("latest_frame_id") != st.session_state.latest_table_id:
+            st.session_state.latest_frame = st.session_state.latest_table.to_pandas()
+            st.session_state.latest_frame_id = st.session_state.latest_table_id
+        helpers.display_intelligent_chart(
+            st.session_state.latest_frame, st.session_state.latest_query, st.session_state.latest_table_id
+        )
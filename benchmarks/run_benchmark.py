@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import settings
+from models import entity_gazetteer, query_cache, query_executor, query_processor, result_cache, single_flight, warmup
+from utils import tracing
+from benchmarks import stub_llm
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Offline end-to-end benchmark: replays a corpus of questions through the NL-to-SQL
+# pipeline with a stub LLM (recorded responses, simulated latency), executes the
+# SQL against the configured Postgres, and reports per-stage latency percentiles,
+# throughput, memory and cache hit rates as JSON.
+#
+#   python -m benchmarks.run_benchmark --sessions 8 --repeat 3 --output run.json
+#   python -m benchmarks.run_benchmark --compare baseline.json run.json
+#   python -m benchmarks.run_benchmark --corpus questions.txt --record corpus.json
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.json")
+PERCENTILES = (50, 90, 95, 99)
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _summary(values):
+    values = np.asarray(values, dtype=float)
+    summary = {"count": int(values.size), "mean_ms": round(float(values.mean()), 1)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}_ms"] = round(float(value), 1)
+    return summary
+
+def run_question(question, pipeline, execute):
+    """Runs one question end to end inside a trace and returns the trace plus outcome."""
+    outcome = {"question": question, "ok": True}
+    with tracing.trace("benchmark") as request_trace:
+        if pipeline == "async":
+            from models import async_query_processor
+            sql_query = async_query_processor.run_query(question)
+        elif pipeline == "stream":
+            sql_query = query_processor.process_natural_language_query(question, on_partial_sql=lambda partial: None)
+        else:
+            sql_query = query_processor.process_natural_language_query(question)
+
+        # Same check as app.py.
+        if "error" in sql_query.lower():
+            outcome.update(ok=False, error=sql_query)
+        elif execute:
+            try:
+                table, _, _ = query_executor.execute_query(sql_query)
+                outcome["rows"] = table.num_rows
+            except Exception as e:
+                outcome.update(ok=False, error=f"Error: {e}")
+    outcome["trace"] = request_trace.to_dict()
+    return outcome
+
+def run_session(session, questions, repeat, pipeline, execute, seed):
+    """One simulated user: asks the corpus `repeat` times in a shuffled order."""
+    order = random.Random(seed + session)
+    results = []
+    for _ in range(repeat):
+        batch = list(questions)
+        order.shuffle(batch)
+        results.extend(run_question(question, pipeline, execute) for question in batch)
+    return results
+
+def _cache_rate(hits, misses):
+    total = hits + misses
+    return round(hits / total, 3) if total else None
+
+def summarize(results, wall_seconds, sessions):
+    stages = {}
+    for result in results:
+        for span in result["trace"]["spans"]:
+            stages.setdefault(span["stage"], []).append(span["duration_ms"])
+
+    traces = [result["trace"] for result in results]
+    query_hits = sum(1 for trace in traces if trace.get("query_cache_hit"))
+    result_lookups = [trace["result_cache_hit"] for trace in traces if "result_cache_hit" in trace]
+    tokens = {"prompt": 0, "completion": 0}
+    for trace in traces:
+        for kind, value in trace.get("tokens", {}).items():
+            tokens[kind] += value
+
+    return {
+        "questions": len(results),
+        "errors": sum(1 for result in results if not result["ok"]),
+        "sessions": sessions,
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_qps": round(len(results) / wall_seconds, 2) if wall_seconds else None,
+        "end_to_end": _summary([trace["total_ms"] for trace in traces]),
+        "stages": {stage: _summary(durations) for stage, durations in sorted(stages.items())},
+        "cache_hit_rates": {
+            "query": _cache_rate(query_hits, len(traces) - query_hits) if settings.QUERY_CACHE_ENABLED else None,
+            "result": _cache_rate(sum(result_lookups), len(result_lookups) - sum(result_lookups)),
+        },
+        "llm_tokens": tokens,
+        "peak_rss_mb": _peak_rss_mb(),
+        "query_cache": query_cache.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "entity_prefilter": entity_gazetteer.get_stats(),
+        "single_flight": single_flight.get_stats(),
+    }
+
+def _configuration(args):
+    return {
+        "pipeline": args.pipeline,
+        "execute": not args.no_execute,
+        "llm_first_token_ms": args.llm_first_token_ms,
+        "llm_per_token_ms": args.llm_per_token_ms,
+        "settings": {
+            name: getattr(settings, name) for name in (
+                "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "QUERY_CACHE_ENABLED", "RESULT_CACHE_ENABLED",
+                "ENTITY_PREFILTER_ENABLED", "VECTOR_SEARCH_BACKEND", "VECTOR_METRIC", "HNSW_EF_SEARCH",
+                "ENTITY_TOP_K", "COST_GUARD_MODE", "SCHEMA_MAX_TABLES", "SINGLE_FLIGHT_ENABLED",
+            )
+        },
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+def run(args):
+    questions = stub_llm.load_corpus(args.corpus)
+    stub = stub_llm.install(
+        questions, args.llm_first_token_ms, args.llm_per_token_ms, args.llm_jitter, args.seed,
+        asynchronous=args.pipeline == "async",
+    )
+
+    if not args.skip_warmup:
+        print("Warming up (embedding model, connection pool, schema, gazetteer)...")
+        warmup.start_background_warmup()
+        while not warmup.is_warm():
+            time.sleep(0.1)
+    if not args.keep_caches:
+        query_cache.clear()
+        result_cache.clear()
+
+    texts = [entry["question"] for entry in questions]
+    print(f"Running {len(texts)} questions x {args.repeat} in {args.sessions} sessions ({args.pipeline} pipeline)...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [
+            pool.submit(run_session, session, texts, args.repeat, args.pipeline, not args.no_execute, args.seed)
+            for session in range(args.sessions)
+        ]
+        results = [result for future in futures for result in future.result()]
+    wall_seconds = time.perf_counter() - started
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "configuration": _configuration(args),
+        "summary": summarize(results, wall_seconds, args.sessions),
+        "llm_calls": stub.completions.calls,
+    }
+    if args.include_traces:
+        report["results"] = results
+    else:
+        report["failures"] = [
+            {"question": result["question"], "error": result["error"]} for result in results if not result["ok"]
+        ]
+    return report
+
+def _load_questions(path):
+    # A plain text file (one question per line) is accepted for recording.
+    if path.endswith(".txt"):
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [entry["question"] for entry in stub_llm.load_corpus(path)]
+
+def record(corpus_path, output):
+    """Runs each question once against the real OpenAI API and saves the responses as a corpus."""
+    recorder = stub_llm.RecordingOpenAI(query_processor._get_openai())
+    query_processor._openai = recorder
+    query_cache.clear()
+    for question in _load_questions(corpus_path):
+        query_processor.process_natural_language_query(question)
+    with open(output, "w") as f:
+        json.dump({
+            "description": "Recorded entity-extraction and SQL-generation responses for offline benchmarks.",
+            "questions": recorder.corpus(),
+        }, f, indent=2)
+    print(f"Recorded {len(recorder.entries)} questions to {output}")
+
+def print_report(report):
+    summary = report["summary"]
+    print(f"\n{summary['questions']} questions, {summary['errors']} errors, "
+          f"{summary['throughput_qps']} questions/sec with {summary['sessions']} sessions, "
+          f"peak RSS {summary['peak_rss_mb']} MB")
+    print(f"{'stage':<28}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = [("end_to_end", summary["end_to_end"])] + list(summary["stages"].items())
+    for stage, stats in rows:
+        print(f"{stage:<28}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"Cache hit rates: {summary['cache_hit_rates']}, LLM tokens: {summary['llm_tokens']}")
+
+def compare(baseline_path, candidate_path):
+    """Prints p50/p95 changes per stage between two saved reports."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    with open(candidate_path) as f:
+        candidate = json.load(f)["summary"]
+
+    def rows(summary):
+        return {"end_to_end": summary["end_to_end"], **summary["stages"]}
+
+    before, after = rows(baseline), rows(candidate)
+    print(f"{'stage':<28}{'p50 before':>12}{'p50 after':>12}{'change':>9}{'p95 before':>12}{'p95 after':>12}{'change':>9}")
+    for stage in sorted(before.keys() | after.keys(), key=lambda name: (name != "end_to_end", name)):
+        cells = []
+        for key in ("p50_ms", "p95_ms"):
+            old, new = before.get(stage, {}).get(key), after.get(stage, {}).get(key)
+            change = f"{(new - old) / old * 100:+.0f}%" if old and new is not None else "-"
+            cells += [old if old is not None else "-", new if new is not None else "-", change]
+        print(f"{stage:<28}" + "".join(f"{str(cell):>12}" if i % 3 != 2 else f"{cell:>9}" for i, cell in enumerate(cells)))
+    print(f"Throughput: {baseline['throughput_qps']} -> {candidate['throughput_qps']} questions/sec")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the NL-to-SQL pipeline.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Recorded questions and LLM responses.")
+    parser.add_argument("--pipeline", choices=["sync", "stream", "async"], default="sync")
+    parser.add_argument("--sessions", type=int, default=1, help="Concurrent simulated users.")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each session asks the corpus.")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0, help="Simulated LLM time to first token.")
+    parser.add_argument("--llm-per-token-ms", type=float, default=10.0, help="Simulated LLM delay per output token.")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="Relative random jitter of the first-token latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-execute", action="store_true", help="Stop after SQL generation and validation.")
+    parser.add_argument("--keep-caches", action="store_true", help="Don't clear the query and result caches first.")
+    parser.add_argument("--skip-warmup", action="store_true", help="Include cold-start costs in the measurements.")
+    parser.add_argument("--include-traces", action="store_true", help="Store every request's trace in the output.")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--record", metavar="OUTPUT", help="Record real LLM responses for the corpus questions and exit.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two saved reports and exit.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    if args.record:
+        record(args.corpus, args.record)
+        sys.exit(0)
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Report written to {args.output}")
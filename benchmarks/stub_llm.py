@@ -0,0 +1,174 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Deterministic stand-ins for the OpenAI client used by models/query_processor.py
+# and models/async_query_processor.py. Responses are replayed from a recorded
+# corpus; latency is simulated as a time to first token plus a delay per token.
+
+_QUESTION_IN_ENTITY_PROMPT = re.compile(r'User Question: "(.*)"')
+_QUESTION_IN_SQL_PROMPT = re.compile(r"### User's Question\s*\n\s*(.*)")
+# Roughly four characters per token, as for the real tokenizer on English/SQL.
+CHARS_PER_TOKEN = 4
+
+class UnknownQuestionError(KeyError):
+    pass
+
+def load_corpus(path):
+    with open(path) as f:
+        return json.load(f)["questions"]
+
+class _Recorded:
+    """Looks up the recorded response for a prompt."""
+
+    def __init__(self, corpus):
+        self.entries = {entry["question"]: entry for entry in corpus}
+
+    def _match(self, text):
+        # The SQL prompt may carry a "(clarification: ...)" suffix after the question.
+        candidates = [question for question in self.entries if text.startswith(question)]
+        if not candidates:
+            raise UnknownQuestionError(f"No recorded response for: {text[:80]}")
+        return self.entries[max(candidates, key=len)]
+
+    def respond(self, messages, response_format=None):
+        prompt = messages[-1]["content"]
+        if response_format and response_format.get("type") == "json_object":
+            match = _QUESTION_IN_ENTITY_PROMPT.search(prompt)
+            entry = self._match(match.group(1) if match else "")
+            return json.dumps(entry["entities"]), prompt
+        match = _QUESTION_IN_SQL_PROMPT.search(prompt)
+        entry = self._match(match.group(1).strip() if match else "")
+        return entry["sql"], prompt
+
+def _usage(prompt, content):
+    return SimpleNamespace(
+        prompt_tokens=len(prompt) // CHARS_PER_TOKEN,
+        completion_tokens=max(1, len(content) // CHARS_PER_TOKEN),
+    )
+
+def _completion(content, usage):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+def _chunks(content, usage):
+    for start in range(0, len(content), CHARS_PER_TOKEN):
+        delta = SimpleNamespace(content=content[start:start + CHARS_PER_TOKEN])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+    # With stream_options={"include_usage": True} the last chunk has no choices.
+    yield SimpleNamespace(choices=[], usage=usage)
+
+class _Stream:
+    def __init__(self, chunks, per_token):
+        self._chunks = chunks
+        self._per_token = per_token
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self.closed:
+                return
+            time.sleep(self._per_token)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+class _Latency:
+    def __init__(self, first_token_ms, per_token_ms, jitter, seed):
+        self.first_token = first_token_ms / 1000
+        self.per_token = per_token_ms / 1000
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def first(self):
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+        return self.first_token * factor
+
+    def total(self, usage):
+        return self.first() + self.per_token * usage.completion_tokens
+
+class _Completions:
+    def __init__(self, recorded, latency):
+        self._recorded = recorded
+        self._latency = latency
+        self.calls = 0
+        # Benchmark sessions call create() from many threads at once.
+        self._calls_lock = threading.Lock()
+
+    def _count_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def create(self, model=None, messages=None, response_format=None, stream=False, **kwargs):
+        self._count_call()
+        content, prompt = self._recorded.respond(messages, response_format)
+        usage = _usage(prompt, content)
+        if stream:
+            time.sleep(self._latency.first())
+            return _Stream(_chunks(content, usage), self._latency.per_token)
+        time.sleep(self._latency.total(usage))
+        return _completion(content, usage)
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model=None, messages=None, response_format=None, **kwargs):
+        self._count_call()
+        content, prompt = self._recorded.respond(messages, response_format)
+        usage = _usage(prompt, content)
+        await asyncio.sleep(self._latency.total(usage))
+        return _completion(content, usage)
+
+class StubOpenAI:
+    """
+    Replaces the `openai` module in query_processor (`query_processor._openai`)
+    or the AsyncOpenAI client in async_query_processor (`_client`).
+    """
+
+    def __init__(self, corpus, first_token_ms=300.0, per_token_ms=10.0, jitter=0.2, seed=0, asynchronous=False):
+        completions_class = _AsyncCompletions if asynchronous else _Completions
+        self.completions = completions_class(_Recorded(corpus), _Latency(first_token_ms, per_token_ms, jitter, seed))
+        self.chat = SimpleNamespace(completions=self.completions)
+
+def install(corpus, first_token_ms=300.0, per_token_ms=10.0, jitter=0.2, seed=0, asynchronous=False):
+    """Points the sync (or async) pipeline at a stub client and returns it."""
+    stub = StubOpenAI(corpus, first_token_ms, per_token_ms, jitter, seed, asynchronous)
+    if asynchronous:
+        from models import async_query_processor
+        async_query_processor._client = stub
+    else:
+        from models import query_processor
+        query_processor._openai = stub
+    return stub
+
+class RecordingOpenAI:
+    """Wraps the real client and stores each question's responses in corpus format."""
+
+    def __init__(self, client):
+        self._client = client
+        self.entries = {}
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, messages=None, response_format=None, **kwargs):
+        if response_format:
+            kwargs["response_format"] = response_format
+        response = self._client.chat.completions.create(messages=messages, **kwargs)
+        prompt = messages[-1]["content"]
+        content = response.choices[0].message.content
+        if response_format and response_format.get("type") == "json_object":
+            question = _QUESTION_IN_ENTITY_PROMPT.search(prompt).group(1)
+            self.entries.setdefault(question, {"question": question})["entities"] = json.loads(content)
+        else:
+            question = _QUESTION_IN_SQL_PROMPT.search(prompt).group(1).split(" (clarification:")[0].strip()
+            self.entries.setdefault(question, {"question": question})["sql"] = content.strip()
+        return response
+
+    def corpus(self):
+        """Returns the recorded entries; questions the pre-filter answered locally get empty entities."""
+        empty = {"product_names": [], "employee_names": [], "customer_names": []}
+        return [{"question": q, "entities": e.get("entities", empty), "sql": e.get("sql", "")} for q, e in self.entries.items()]
@@ -1,16 +1,87 @@
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, event
 from config import settings
 
-def get_db_engine():
-    """
-    Creates and returns a SQLAlchemy engine for the PostgreSQL database.
-    """
-    # Create the database connection URL
-    db_url = (
+# A single engine (and therefore a single connection pool) is shared by the
+# whole process. Streamlit sessions run on separate threads, so creation is
+# guarded by a lock.
+_engine = None
+_engine_lock = threading.Lock()
+
+def _build_db_url():
+    return (
         f"postgresql+psycopg2://{settings.DB_USER}:{settings.DB_PASSWORD}@"
         f"{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
     )
-    
-    # Create the SQLAlchemy engine
-    engine = create_engine(db_url)
-    return engine
\ No newline at end of file
+
+def get_db_engine():
+    """
+    Returns the process-wide SQLAlchemy engine for the PostgreSQL database,
+    creating it with the configured connection pool on first use.
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+
+    with _engine_lock:
+        if _engine is None:
+            connect_args = {}
+            if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+                connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+
+            _engine = create_engine(
+                _build_db_url(),
+                pool_size=settings.DB_POOL_SIZE,
+                max_overflow=settings.DB_MAX_OVERFLOW,
+                pool_timeout=settings.DB_POOL_TIMEOUT,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+                pool_pre_ping=settings.DB_POOL_PRE_PING,
+                connect_args=connect_args,
+            )
+            event.listen(_engine, "connect", _register_vector_type)
+    return _engine
+
+def _register_vector_type(dbapi_connection, connection_record):
+    """
+    Registers the pgvector adapter on every new DBAPI connection so numpy arrays
+    can be passed as bound parameters and vector columns come back as arrays.
+    """
+    try:
+        from pgvector.psycopg2 import register_vector
+        register_vector(dbapi_connection)
+    except Exception as e:
+        # The extension may not be installed yet (e.g. before add_embeddings.sql runs).
+        print(f"Could not register pgvector type: {e}")
+    finally:
+        # Don't leave the type lookup's transaction open on a fresh pooled connection.
+        dbapi_connection.rollback()
+
+def get_pool_stats():
+    """
+    Returns a snapshot of connection pool utilization for the shared engine.
+    """
+    if _engine is None:
+        return {"initialized": False}
+
+    pool = _engine.pool
+    checked_out = pool.checkedout()
+    capacity = pool.size() + settings.DB_MAX_OVERFLOW
+    return {
+        "initialized": True,
+        "pool_size": pool.size(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "utilization": checked_out / capacity if capacity else 0.0,
+    }
+
+def dispose_engine():
+    """
+    Closes all pooled connections and forgets the shared engine.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
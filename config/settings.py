@@ -4,13 +4,91 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # OpenAI API Key
+# Checked when an OpenAI client is first needed, so the app can start (and
+# render a helpful error) without it.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("No OpenAI API key found...")
+
+def require_openai_api_key():
+    if not OPENAI_API_KEY:
+        raise ValueError("No OpenAI API key found...")
+    return OPENAI_API_KEY
 
 # Database Credentials
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
\ No newline at end of file
+DB_PORT = os.getenv("DB_PORT")
+
+# Connection Pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+# NL-to-SQL Cache
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "500"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+QUERY_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("QUERY_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+# Vector Search
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "cosine")
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+VECTOR_INDEX_CHECK_ON_STARTUP = os.getenv("VECTOR_INDEX_CHECK_ON_STARTUP", "true").lower() == "true"
+ENTITY_TOP_K = int(os.getenv("ENTITY_TOP_K", "3"))
+
+# Local Vector Index ("postgres" or "local")
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "postgres")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".vector_index"))
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")  # "float32" or "int8"
+LOCAL_INDEX_REFRESH_SECONDS = int(os.getenv("LOCAL_INDEX_REFRESH_SECONDS", "300"))
+
+# Entity Extraction Pre-filter
+ENTITY_PREFILTER_ENABLED = os.getenv("ENTITY_PREFILTER_ENABLED", "true").lower() == "true"
+ENTITY_PREFILTER_FORWARD_THRESHOLD = float(os.getenv("ENTITY_PREFILTER_FORWARD_THRESHOLD", "0.3"))
+ENTITY_PREFILTER_REFRESH_SECONDS = int(os.getenv("ENTITY_PREFILTER_REFRESH_SECONDS", "600"))
+
+# Async Pipeline
+ASYNC_PIPELINE_ENABLED = os.getenv("ASYNC_PIPELINE_ENABLED", "false").lower() == "true"
+
+# Streaming SQL Generation
+STREAM_SQL_GENERATION = os.getenv("STREAM_SQL_GENERATION", "true").lower() == "true"
+
+# Query Cost Guard
+COST_GUARD_MODE = os.getenv("COST_GUARD_MODE", "reject")  # "reject", "warn" or "off"
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", "1000000"))
+COST_GUARD_MAX_ROWS = float(os.getenv("COST_GUARD_MAX_ROWS", "5000000"))
+COST_GUARD_LARGE_TABLE_ROWS = float(os.getenv("COST_GUARD_LARGE_TABLE_ROWS", "1000000"))
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "15000"))
+
+# Result Fetching
+DEFAULT_RESULT_LIMIT = int(os.getenv("DEFAULT_RESULT_LIMIT", "100"))
+MAX_RESULT_LIMIT = int(os.getenv("MAX_RESULT_LIMIT", "1000"))
+RESULT_FIRST_PAGE_ROWS = int(os.getenv("RESULT_FIRST_PAGE_ROWS", "500"))
+RESULT_FETCH_CHUNK_ROWS = int(os.getenv("RESULT_FETCH_CHUNK_ROWS", "10000"))
+
+# Schema Introspection
+SCHEMA_CACHE_SECONDS = int(os.getenv("SCHEMA_CACHE_SECONDS", "300"))
+
+# Result Cache
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("RESULT_CACHE_VERSION_CHECK_SECONDS", "2"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))  # 0 keeps results until their tables change.
+SCHEMA_MAX_TABLES = int(os.getenv("SCHEMA_MAX_TABLES", "8"))
+
+# Metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serves Prometheus metrics on /metrics; 0 disables it.
+
+# Single-flight Coalescing
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("SINGLE_FLIGHT_TIMEOUT_SECONDS", "60"))
+SINGLE_FLIGHT_LOCK_DIR = os.getenv("SINGLE_FLIGHT_LOCK_DIR", "")  # Shared directory for cross-process coalescing; empty disables it.
+
+# Charts
+CHART_LLM_FALLBACK = os.getenv("CHART_LLM_FALLBACK", "true").lower() == "true"  # Ask the LLM only when no local rule fits.
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", "25"))
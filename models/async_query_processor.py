@@ -0,0 +1,221 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import asyncpg
+import openai
+from pgvector.asyncpg import register_vector
+from config import settings
+from utils import embedding_provider, tracing
+from models import local_vector_index, query_cache, query_processor, schema_provider, single_flight, vector_search
+
+# All async resources (OpenAI client, asyncpg pool) are bound to one event loop
+# that runs on a background thread for the lifetime of the process. Streamlit
+# script threads submit coroutines to it with run_query().
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_pool = None
+_pool_lock = None
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-query-pipeline", daemon=True).start()
+    return _loop
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = openai.AsyncOpenAI(api_key=settings.require_openai_api_key())
+    return _client
+
+async def _init_connection(connection):
+    # Registers the binary pgvector codec, so query vectors travel as float32.
+    await register_vector(connection)
+
+async def _get_pool():
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    # Created on the pipeline's loop; nothing awaits between the check and the assignment.
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    # Coroutines arriving together would otherwise each create (and leak) a pool.
+    async with _pool_lock:
+        if _pool is None:
+            server_settings = {}
+            if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+                server_settings["statement_timeout"] = str(settings.DB_STATEMENT_TIMEOUT_MS)
+            _pool = await asyncpg.create_pool(
+                user=settings.DB_USER,
+                password=settings.DB_PASSWORD,
+                host=settings.DB_HOST,
+                port=settings.DB_PORT,
+                database=settings.DB_NAME,
+                min_size=1,
+                max_size=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+                max_inactive_connection_lifetime=settings.DB_POOL_RECYCLE,
+                server_settings=server_settings,
+                init=_init_connection,
+            )
+    return _pool
+
+async def _timed(stage: str, awaitable):
+    """Awaits a stage inside a tracing span, so overlapping stages show their start/end offsets."""
+    with tracing.span(stage):
+        return await awaitable
+
+async def _extract_entities(query: str):
+    entities = await asyncio.to_thread(query_processor._prefilter_entities, query)
+    if entities is not None:
+        return entities
+    try:
+        with tracing.span("entity_extraction"):
+            response = await _get_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=query_processor._entity_extraction_messages(query),
+                response_format={"type": "json_object"},
+                temperature=0.0,
+            )
+            tracing.record_tokens("entity_extraction", response.usage)
+        return query_processor._parse_entities(response.choices[0].message.content)
+    except Exception:
+        return {}
+
+async def _resolve_entities(entities: dict):
+    terms = vector_search.entity_terms(entities)
+    if not terms:
+        return {}
+
+    # Encoding is CPU-bound, so it runs off the event loop.
+    embeddings = await _timed(
+        "embedding", asyncio.to_thread(embedding_provider.encode, [term for _, term in terms])
+    )
+    grouped = vector_search.group_embeddings(terms, embeddings)
+
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        # The local index may refresh from the database, so it also runs off the loop.
+        rows = await _timed(
+            "vector_search", asyncio.to_thread(local_vector_index.lookup_rows, grouped, settings.ENTITY_TOP_K)
+        )
+        return vector_search.collect_entity_results(terms, rows)
+
+    param_names = [f"{entity}_embeddings" for entity in grouped] + ["top_k"]
+    sql_query = vector_search.build_entity_lookup_sql(grouped, lambda name: f"${param_names.index(name) + 1}")
+    args = list(grouped.values()) + [settings.ENTITY_TOP_K]
+
+    pool = await _get_pool()
+    with tracing.span("vector_search", backend="postgres"):
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(f"SET LOCAL hnsw.ef_search = {int(settings.HNSW_EF_SEARCH)}")
+                # asyncpg prepares and caches the statement per connection.
+                rows = await connection.fetch(sql_query, *args)
+
+    return vector_search.collect_entity_results(terms, [tuple(row) for row in rows])
+
+async def _generate_sql(schema_task, enriched_query: str, stage: str):
+    # Shielded so cancelling the speculative call doesn't cancel the shared schema load.
+    schema = await asyncio.shield(schema_task)
+    with tracing.span(stage):
+        response = await _get_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=query_processor._sql_generation_messages(schema, enriched_query),
+            temperature=0.0,
+            max_tokens=500
+        )
+        tracing.record_tokens(stage, response.usage)
+    return response.choices[0].message.content
+
+async def process_natural_language_query_async(query: str):
+    """
+    Async version of query_processor.process_natural_language_query.
+
+    SQL generation starts speculatively on the raw question while entities are
+    extracted and resolved. The speculative result is used unless resolution
+    adds a clarification to the prompt, in which case it is cancelled and the
+    SQL is regenerated for the enriched question. Stages are recorded as spans
+    of the active trace.
+    """
+    print(f"Received query (async): '{query}'")
+
+    # Cache lookups embed the question and may check the schema: keep them off the shared loop.
+    with tracing.span("query_cache"):
+        cached_sql = await asyncio.to_thread(query_cache.get, query)
+    if settings.QUERY_CACHE_ENABLED:
+        tracing.record_cache("query", cached_sql is not None)
+    if cached_sql is not None:
+        print("Query cache hit. Skipping LLM calls.")
+        return cached_sql
+
+    schema_task = asyncio.ensure_future(
+        _timed("schema_load", asyncio.to_thread(schema_provider.get_prompt_schema, query))
+    )
+    speculative_task = asyncio.ensure_future(_generate_sql(schema_task, query, "sql_generation_speculative"))
+
+    try:
+        entities = await _extract_entities(query)
+        resolved = {}
+        if entities:
+            print(f"Fuzzy entities found: {entities}. Performing vector search...")
+            try:
+                resolved = await _resolve_entities(entities)
+            except Exception as e:
+                print(f"Vector search failed: {e}")
+        enriched_query = query_processor._enrich_query(query, resolved)
+
+        if enriched_query == query:
+            raw_response = await speculative_task
+        else:
+            print(f"Enriched query for SQL generation: '{enriched_query}'. Reissuing SQL generation.")
+            speculative_task.cancel()
+            raw_response = await _generate_sql(schema_task, enriched_query, "sql_generation")
+
+        return await asyncio.to_thread(query_processor._finalize_sql, query, raw_response)
+    except Exception as e:
+        speculative_task.cancel()
+        return f"Error: An unexpected error occurred: {e}"
+
+async def _run_in_trace(request_trace, query: str):
+    # Tasks and threads started by the pipeline copy this context, so their spans
+    # land in the caller's trace.
+    with tracing.use(request_trace):
+        return await process_natural_language_query_async(query)
+
+def run_query(query: str, timeout: float = None):
+    """
+    Runs the async pipeline from synchronous code (e.g. the Streamlit script
+    thread), recording its spans in the caller's active trace. Concurrent
+    identical questions share one run, as in the sync pipeline.
+    """
+    try:
+        sql_query, shared = single_flight.run(
+            "question",
+            query_cache.normalize_question(query),
+            lambda progress: _run_on_loop(query, timeout),
+            serializer=single_flight.TEXT,
+        )
+    except TimeoutError as e:
+        return f"Error: {e}"
+    if shared:
+        tracing.annotate(coalesced=True)
+    return sql_query
+
+def _run_on_loop(query: str, timeout: float = None):
+    future = asyncio.run_coroutine_threadsafe(_run_in_trace(tracing.current(), query), _get_loop())
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return future.result(0.1)
+            except concurrent.futures.TimeoutError:
+                single_flight.check_cancelled()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+    except BaseException:
+        # Every caller left or gave up: stop the pipeline on the loop too.
+        future.cancel()
+        raise
@@ -0,0 +1,74 @@
+import json
+from sqlalchemy import text
+from config import settings
+
+class QueryCostError(Exception):
+    """Raised when a query's estimated plan exceeds the configured limits."""
+
+def _walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+def _row_nodes(plan: dict):
+    """Like _walk, but stops at Limit nodes: the rows below one are never all read."""
+    yield plan
+    if plan.get("Node Type") == "Limit":
+        return
+    for child in plan.get("Plans", []):
+        yield from _row_nodes(child)
+
+def _table_sizes(connection, relations):
+    if not relations:
+        return {}
+    rows = connection.execute(
+        text("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relname = ANY(:names)"),
+        {"names": list(relations)},
+    ).fetchall()
+    return {name: float(tuples) for name, tuples in rows}
+
+def check_query_cost(connection, sql_query: str):
+    """
+    Runs EXPLAIN (FORMAT JSON) on the query and checks the estimated plan.
+
+    Total cost and the largest row estimate are hard limits: in "reject" mode a
+    QueryCostError is raised, in "warn" mode they become warnings. Row
+    estimates below a Limit node don't count, since the limit stops the scan
+    early (its cost still counts towards the total). Sequential
+    scans over large tables are always reported as warnings only, because a
+    LIMIT on top of them can still make them cheap.
+
+    Returns a list of warning strings.
+    """
+    if settings.COST_GUARD_MODE == "off":
+        return []
+
+    raw_plan = connection.execute(text("EXPLAIN (FORMAT JSON) " + sql_query)).scalar()
+    plan = (raw_plan if isinstance(raw_plan, list) else json.loads(raw_plan))[0]["Plan"]
+    nodes = list(_walk(plan))
+
+    violations = []
+    total_cost = plan.get("Total Cost", 0.0)
+    if total_cost > settings.COST_GUARD_MAX_COST:
+        violations.append(f"estimated cost {total_cost:,.0f} exceeds {settings.COST_GUARD_MAX_COST:,.0f}")
+
+    max_rows = max(node.get("Plan Rows", 0) for node in _row_nodes(plan))
+    if max_rows > settings.COST_GUARD_MAX_ROWS:
+        violations.append(f"estimated {max_rows:,.0f} rows in one plan step exceeds {settings.COST_GUARD_MAX_ROWS:,.0f}")
+
+    warnings = []
+    seq_scans = {node["Relation Name"] for node in nodes if node.get("Node Type") == "Seq Scan" and "Relation Name" in node}
+    for relation, tuples in _table_sizes(connection, seq_scans).items():
+        if tuples >= settings.COST_GUARD_LARGE_TABLE_ROWS:
+            warnings.append(f"sequential scan on large table '{relation}' (~{tuples:,.0f} rows)")
+
+    if violations:
+        message = "Query rejected by cost guard: " + "; ".join(violations) + "."
+        if settings.COST_GUARD_MODE == "reject":
+            print(message)
+            raise QueryCostError(message)
+        warnings = violations + warnings
+
+    for warning in warnings:
+        print(f"Cost guard warning: {warning}")
+    return warnings
@@ -0,0 +1,187 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import text
+from config import database, settings
+from models import vector_search
+
+# Words that commonly appear in analytical questions and are never entity names.
+# Table and column names are added to this set when the gazetteer is built.
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "by", "with", "from", "at", "as",
+    "is", "are", "was", "were", "be", "been", "has", "have", "had", "do", "does", "did",
+    "what", "which", "who", "whom", "whose", "how", "many", "much", "when", "where", "why",
+    "show", "list", "give", "get", "find", "tell", "me", "all", "each", "every", "per", "any",
+    "top", "bottom", "first", "last", "highest", "lowest", "most", "least", "best", "worst",
+    "average", "avg", "total", "sum", "count", "number", "min", "max", "minimum", "maximum", "mean",
+    "than", "more", "less", "greater", "over", "under", "between", "above", "below", "order", "ordered",
+    "sort", "sorted", "group", "grouped", "paid", "sold", "made", "placed", "handled", "sales",
+    "year", "month", "week", "day", "date", "today", "yesterday", "recent", "latest", "this", "that",
+    "their", "them", "they", "its", "it", "i", "we", "our", "my", "there", "about", "into", "only",
+    "not", "no", "yes", "equal", "equals", "rank", "ranked", "compare", "comparison", "versus", "vs",
+}
+
+# Built lazily and rebuilt every ENTITY_PREFILTER_REFRESH_SECONDS.
+_gazetteer = None
+_built_at = 0.0
+_lock = threading.Lock()
+_stats = {"skipped": 0, "forwarded": 0, "exact_only": 0, "unavailable": 0}
+# Separate from _lock, which is held while the gazetteer is rebuilt.
+_stats_lock = threading.Lock()
+
+def _tokenize(value: str):
+    return re.findall(r"[a-z0-9][a-z0-9'\-]*", value.lower())
+
+def _trigrams(token: str):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _build():
+    """Loads every searchable name from the database and indexes it in memory."""
+    names = {}
+    vocabulary = set()
+    schema_words = set()
+    engine = database.get_db_engine()
+    with engine.connect() as connection:
+        for entity, lookup in vector_search.ENTITY_LOOKUPS.items():
+            rows = connection.execute(
+                text(f"SELECT DISTINCT {lookup['name_column']} FROM {lookup['table']}")
+            ).fetchall()
+            for (name,) in rows:
+                if not name:
+                    continue
+                names.setdefault(" ".join(_tokenize(name)), (entity, name))
+                vocabulary.update(_tokenize(name))
+        # Words from every table and column name, e.g. "orders" or "salary".
+        columns = connection.execute(
+            text("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()")
+        ).fetchall()
+        for table, column in columns:
+            for word in table.lower().split("_"):
+                schema_words.add(word)
+                schema_words.add(word.rstrip("s"))
+            schema_words.update(column.lower().split("_"))
+
+    trigram_index = defaultdict(set)
+    tokens = sorted(vocabulary)
+    for position, token in enumerate(tokens):
+        for trigram in _trigrams(token):
+            trigram_index[trigram].add(position)
+
+    return {
+        "names": names,
+        "max_name_words": max((len(name.split()) for name in names), default=0),
+        "tokens": tokens,
+        "token_trigram_counts": [len(_trigrams(token)) for token in tokens],
+        "trigram_index": trigram_index,
+        "ignore": STOPWORDS | schema_words,
+    }
+
+def _get_gazetteer():
+    global _gazetteer, _built_at
+    now = time.time()
+    if _gazetteer is not None and now - _built_at < settings.ENTITY_PREFILTER_REFRESH_SECONDS:
+        return _gazetteer
+    with _lock:
+        if _gazetteer is None or now - _built_at >= settings.ENTITY_PREFILTER_REFRESH_SECONDS:
+            try:
+                _gazetteer = _build()
+                _built_at = now
+                print(f"Entity gazetteer built with {len(_gazetteer['names'])} names.")
+            except Exception as e:
+                print(f"Could not build entity gazetteer: {e}")
+                # Keep serving the previous gazetteer (if any) and retry on the next refresh.
+                _built_at = now
+    return _gazetteer
+
+def _best_similarity(gazetteer: dict, token: str) -> float:
+    """Trigram (Jaccard) similarity of a token to the closest name token."""
+    query_trigrams = _trigrams(token)
+    shared = defaultdict(int)
+    for trigram in query_trigrams:
+        for position in gazetteer["trigram_index"].get(trigram, ()):
+            shared[position] += 1
+    best = 0.0
+    for position, count in shared.items():
+        union = len(query_trigrams) + gazetteer["token_trigram_counts"][position] - count
+        best = max(best, count / union)
+    return best
+
+def _covered_names(entities: dict):
+    return [" ".join(_tokenize(name)) for names in entities.values() for name in names]
+
+def analyze(query: str):
+    """
+    Decides locally whether the question can mention a product, employee or
+    customer name.
+
+    Returns {"entities": {entity_type: [names]}, "needs_llm": bool, "reason": str},
+    or None when the gazetteer is disabled or unavailable.
+    """
+    if not settings.ENTITY_PREFILTER_ENABLED:
+        return None
+    gazetteer = _get_gazetteer()
+    if gazetteer is None:
+        _record("unavailable")
+        return None
+
+    words = _tokenize(query)
+    covered = set()
+    entities = defaultdict(list)
+
+    # 1. Exact full-name matches, longest phrases first.
+    for size in range(min(gazetteer["max_name_words"], len(words)), 0, -1):
+        for start in range(len(words) - size + 1):
+            span = range(start, start + size)
+            if covered.intersection(span):
+                continue
+            match = gazetteer["names"].get(" ".join(words[start:start + size]))
+            if match and not (size == 1 and words[start] in gazetteer["ignore"]):
+                entity, name = match
+                entities[entity].append(name)
+                covered.update(span)
+
+    # 2. Any remaining word that looks like part of a name means a fuzzy entity
+    #    may be present, so the LLM has to decide.
+    best_score, best_word = 0.0, None
+    for position, word in enumerate(words):
+        if position in covered or word in gazetteer["ignore"] or len(word) < 3 or word.isdigit():
+            continue
+        score = _best_similarity(gazetteer, word)
+        if score > best_score:
+            best_score, best_word = score, word
+
+    # Quoted strings and capitalized words after the first are almost always
+    # names the user wants matched, even when misspelled beyond trigram range.
+    quoted = re.search(r"[\"“][^\"”]+[\"”]|'[^']{3,}'", query)
+    matched_words = {word for name in _covered_names(entities) for word in name.split()}
+    capitalized = [
+        word for word in re.findall(r"(?<=\s)[A-Z][a-z'\-]+", query)
+        if word.lower() not in gazetteer["ignore"] and word.lower() not in matched_words
+    ]
+
+    if best_score >= settings.ENTITY_PREFILTER_FORWARD_THRESHOLD or quoted or capitalized:
+        _record("forwarded")
+        if quoted:
+            reason = "quoted text"
+        elif capitalized:
+            reason = f"capitalized words {capitalized}"
+        else:
+            reason = f"possible fuzzy entity '{best_word}' ({best_score:.2f})"
+        return {"entities": dict(entities), "needs_llm": True, "reason": reason}
+
+    if entities:
+        _record("exact_only")
+    else:
+        _record("skipped")
+    return {"entities": dict(entities), "needs_llm": False, "reason": f"best fuzzy score {best_score:.2f}"}
+
+def _record(event: str):
+    with _stats_lock:
+        _stats[event] += 1
+
+def get_stats():
+    """Returns counters for questions handled locally vs forwarded to the LLM."""
+    with _stats_lock:
+        return dict(_stats)
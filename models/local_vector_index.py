@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import text
+from config import database, settings
+from models import vector_search
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes from several processes are not serialized.
+    fcntl = None
+
+# Each entity column is exported to LOCAL_INDEX_DIR as one "generation":
+#   <entity>.json                 manifest (current generation, metric, dtype, refresh time)
+#   <entity>.<gen>.vectors.npy    float32 or int8 matrix, memory-mapped by every process
+#   <entity>.<gen>.scales.npy     per-row int8 dequantization scales (1.0 for float32)
+#   <entity>.<gen>.norms.npy      squared row norms, for the l2 metric
+#   <entity>.<gen>.rows.json      ids, names and row versions (xmin) in matrix order
+#   <entity>.lock                 held while a process refreshes the export
+# Generations have unique names and every file is written to a temporary path
+# and renamed, so a file another process has memory-mapped is never rewritten.
+# The manifest is replaced last, so readers never see a half-written generation,
+# and the page cache holds a single copy of the matrix for all worker processes.
+DTYPES = ("float32", "int8")
+
+if settings.LOCAL_INDEX_DTYPE not in DTYPES:
+    raise ValueError(f"Unknown LOCAL_INDEX_DTYPE '{settings.LOCAL_INDEX_DTYPE}'. Choose from {list(DTYPES)}.")
+
+_indexes = {}
+_checked_at = {}
+_lock = threading.Lock()
+# One refresh lock per entity: entities refresh independently, and lookups keep
+# using the mapped generation while its replacement is built.
+_refresh_locks = {}
+_stats = {"lookups": 0, "refreshes": 0, "rows_fetched": 0}
+
+def _path(name: str) -> str:
+    return os.path.join(settings.LOCAL_INDEX_DIR, name)
+
+def _read_manifest(entity: str):
+    try:
+        with open(_path(f"{entity}.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # An index exported with another metric or dtype has to be rebuilt from scratch.
+    if manifest.get("metric") != settings.VECTOR_METRIC or manifest.get("dtype") != settings.LOCAL_INDEX_DTYPE:
+        return None
+    return manifest
+
+def _load(entity: str, manifest: dict):
+    prefix = f"{entity}.{manifest['generation']}"
+    with open(_path(f"{prefix}.rows.json")) as f:
+        rows = json.load(f)
+    return {
+        "generation": manifest["generation"],
+        "vectors": np.load(_path(f"{prefix}.vectors.npy"), mmap_mode="r"),
+        "scales": np.load(_path(f"{prefix}.scales.npy")),
+        "norms": np.load(_path(f"{prefix}.norms.npy")),
+        "ids": rows["ids"],
+        "names": rows["names"],
+        "versions": rows["versions"],
+    }
+
+def _load_current(entity: str):
+    """Maps the generation named by the manifest, or returns None if there is no export."""
+    for _ in range(3):
+        manifest = _read_manifest(entity)
+        if manifest is None:
+            return None
+        try:
+            return _load(entity, manifest)
+        except FileNotFoundError:
+            # A newer export replaced this generation after we read the manifest.
+            continue
+    return None
+
+def _empty(dim: int = 384):
+    dtype = np.int8 if settings.LOCAL_INDEX_DTYPE == "int8" else np.float32
+    return {
+        "generation": 0,
+        "vectors": np.zeros((0, dim), dtype=dtype),
+        "scales": np.zeros(0, dtype=np.float32),
+        "norms": np.zeros(0, dtype=np.float32),
+        "ids": [],
+        "names": [],
+        "versions": [],
+    }
+
+def _encode_rows(embeddings):
+    """Converts fetched embeddings into stored rows: (vectors, scales, squared norms)."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if settings.VECTOR_METRIC == "cosine":
+        # Normalizing once at export turns cosine distance into a single dot product.
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    if settings.LOCAL_INDEX_DTYPE == "float32":
+        return vectors, np.ones(len(vectors), dtype=np.float32), norms
+    # Symmetric per-row int8 quantization: 4x smaller, distances within ~1% of float32.
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32), norms
+
+def _replace(name: str, write, mode: str = "wb"):
+    """Writes a file through a temporary path, so readers only ever see complete files."""
+    temp_path = _path(f"{name}.{os.getpid()}.tmp")
+    with open(temp_path, mode) as f:
+        write(f)
+    os.replace(temp_path, _path(name))
+
+@contextmanager
+def _export_lock(entity: str):
+    """Serializes refreshes of one entity's export across processes."""
+    os.makedirs(settings.LOCAL_INDEX_DIR, exist_ok=True)
+    with open(_path(f"{entity}.lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _write(entity: str, index: dict):
+    previous = _read_manifest(entity)
+    prefix = f"{entity}.{index['generation']}"
+    for suffix in ("vectors", "scales", "norms"):
+        _replace(f"{prefix}.{suffix}.npy", lambda f: np.save(f, index[suffix]))
+    rows = {"ids": index["ids"], "names": index["names"], "versions": index["versions"]}
+    _replace(f"{prefix}.rows.json", lambda f: json.dump(rows, f), mode="w")
+
+    manifest = {
+        "generation": index["generation"],
+        "metric": settings.VECTOR_METRIC,
+        "dtype": settings.LOCAL_INDEX_DTYPE,
+        "rows": len(index["ids"]),
+        "refreshed_at": time.time(),
+    }
+    _replace(f"{entity}.json", lambda f: json.dump(manifest, f), mode="w")
+
+    # Processes still mapping the old files keep them alive until they reload.
+    if previous is not None and previous["generation"] != index["generation"]:
+        for suffix in ("vectors.npy", "scales.npy", "norms.npy", "rows.json"):
+            try:
+                os.remove(_path(f"{entity}.{previous['generation']}.{suffix}"))
+            except OSError:
+                pass
+
+def _touch_manifest(entity: str):
+    manifest = _read_manifest(entity)
+    if manifest is None:
+        return
+    manifest["refreshed_at"] = time.time()
+    _replace(f"{entity}.json", lambda f: json.dump(manifest, f), mode="w")
+
+def refresh(entity: str, current: dict = None):
+    """
+    Brings the exported index for `entity` up to date with the database.
+
+    Only rows whose version (xmin) changed since the last export are fetched;
+    unchanged rows are copied from the current matrix. Returns the new index.
+    Refreshes from several processes take turns on a file lock.
+    """
+    with _export_lock(entity):
+        latest = _read_manifest(entity)
+        if latest and time.time() - latest["refreshed_at"] < settings.LOCAL_INDEX_REFRESH_SECONDS:
+            # Another process refreshed the export while we waited for the lock.
+            if current is None or current["generation"] != latest["generation"]:
+                current = _load(entity, latest)
+            return current
+        # Build on the newest export, which may come from another process.
+        if latest and (current is None or current["generation"] != latest["generation"]):
+            current = _load(entity, latest)
+        return _refresh_locked(entity, current or _empty())
+
+def _refresh_locked(entity: str, current: dict):
+    lookup = vector_search.ENTITY_LOOKUPS[entity]
+
+    engine = database.get_db_engine()
+    with engine.connect() as connection:
+        versions = dict(connection.execute(text(
+            f"SELECT {lookup['id_column']}, xmin::text FROM {lookup['table']} "
+            f"WHERE {lookup['embedding_column']} IS NOT NULL"
+        )).fetchall())
+
+        known = dict(zip(current["ids"], current["versions"]))
+        changed = [item_id for item_id, version in versions.items() if known.get(item_id) != version]
+        removed = len(known.keys() - versions.keys())
+        if not changed and not removed:
+            _touch_manifest(entity)
+            return current
+
+        fetched = []
+        if changed:
+            fetched = connection.execute(
+                text(
+                    f"SELECT {lookup['id_column']}, {lookup['name_column']}, {lookup['embedding_column']} "
+                    f"FROM {lookup['table']} WHERE {lookup['id_column']} = ANY(:ids)"
+                ),
+                {"ids": changed},
+            ).fetchall()
+            fetched = [row for row in fetched if row[2] is not None]
+
+    # Unique per export, so no process ever overwrites files another one maps.
+    generation = uuid.uuid4().hex
+
+    fetched_ids = {row[0] for row in fetched}
+    keep = [
+        position for position, item_id in enumerate(current["ids"])
+        if item_id in versions and item_id not in fetched_ids
+    ]
+    parts = [(current["vectors"][keep], current["scales"][keep], current["norms"][keep])]
+    if fetched:
+        parts.append(_encode_rows([row[2] for row in fetched]))
+    index = {
+        "generation": generation,
+        "vectors": np.concatenate([part[0] for part in parts]),
+        "scales": np.concatenate([part[1] for part in parts]).astype(np.float32),
+        "norms": np.concatenate([part[2] for part in parts]).astype(np.float32),
+        "ids": [current["ids"][p] for p in keep] + [row[0] for row in fetched],
+        "names": [current["names"][p] for p in keep] + [row[1] for row in fetched],
+        "versions": [current["versions"][p] for p in keep] + [versions[row[0]] for row in fetched],
+    }
+    _write(entity, index)
+    with _lock:
+        _stats["refreshes"] += 1
+        _stats["rows_fetched"] += len(fetched)
+    print(f"Local vector index for {entity}: {len(fetched)} rows updated, {removed} removed, {len(index['ids'])} total.")
+    return _load(entity, _read_manifest(entity))
+
+def _get_index(entity: str):
+    now = time.time()
+    index = _indexes.get(entity)
+    if index is not None and now - _checked_at.get(entity, 0) < settings.LOCAL_INDEX_REFRESH_SECONDS:
+        return index
+    with _lock:
+        refresh_lock = _refresh_locks.setdefault(entity, threading.Lock())
+    # Only the first load waits; otherwise serve the current generation while
+    # another thread refreshes it.
+    if not refresh_lock.acquire(blocking=index is None):
+        return index
+    try:
+        index = _indexes.get(entity)
+        if index is not None and now - _checked_at.get(entity, 0) < settings.LOCAL_INDEX_REFRESH_SECONDS:
+            return index
+        manifest = _read_manifest(entity)
+        if manifest and now - manifest["refreshed_at"] < settings.LOCAL_INDEX_REFRESH_SECONDS:
+            # Another process refreshed the export recently; just map its files.
+            if index is None or index["generation"] != manifest["generation"]:
+                index = _load_current(entity) or index or _empty()
+        else:
+            try:
+                index = refresh(entity, index)
+            except Exception as e:
+                print(f"Could not refresh local vector index for {entity}: {e}")
+                # Keep serving the previous export (if any) and retry on the next refresh.
+                if index is None:
+                    index = _load_current(entity) or _empty()
+        _indexes[entity] = index
+        _checked_at[entity] = now
+        return index
+    finally:
+        refresh_lock.release()
+
+def _distances(index: dict, queries: np.ndarray) -> np.ndarray:
+    """Returns an (index rows x queries) matrix of distances, matching pgvector's operators."""
+    if settings.VECTOR_METRIC == "cosine":
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    dots = (index["vectors"] @ queries.T) * index["scales"][:, None]
+    if settings.VECTOR_METRIC == "cosine":
+        return 1.0 - dots
+    if settings.VECTOR_METRIC == "inner_product":
+        return -dots
+    squared = index["norms"][:, None] - 2.0 * dots + np.einsum("ij,ij->i", queries, queries)[None, :]
+    return np.sqrt(np.maximum(squared, 0.0))
+
+def lookup_rows(grouped: dict, top_k: int):
+    """
+    Local equivalent of vector_search.build_entity_lookup_sql: takes
+    {entity_type: [embedding, ...]} and returns (entity, ord, id, name, distance)
+    rows ordered by entity, ord and distance.
+    """
+    rows = []
+    for entity, embeddings in grouped.items():
+        index = _get_index(entity)
+        if not index["ids"]:
+            continue
+        distances = _distances(index, np.asarray(embeddings, dtype=np.float32))
+        k = min(top_k, distances.shape[0])
+        nearest = np.argpartition(distances, k - 1, axis=0)[:k]
+        for column in range(distances.shape[1]):
+            candidates = sorted(nearest[:, column], key=lambda position: distances[position, column])
+            for position in candidates:
+                rows.append((
+                    entity, column + 1, index["ids"][position], index["names"][position],
+                    float(distances[position, column]),
+                ))
+    _stats["lookups"] += 1
+    return rows
+
+def warm_up():
+    """Loads (and if needed refreshes) the index for every entity type."""
+    for entity in vector_search.ENTITY_LOOKUPS:
+        _get_index(entity)
+
+def get_stats():
+    """Returns lookup/refresh counters and the size of each loaded index."""
+    stats = dict(_stats)
+    for entity, index in list(_indexes.items()):
+        stats[entity] = {
+            "rows": len(index["ids"]),
+            "generation": index["generation"],
+            "matrix_bytes": int(index["vectors"].nbytes),
+        }
+    return stats
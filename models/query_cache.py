@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import settings
+from utils import embedding_provider, helpers
+from models import schema_provider
+
+# Process-wide cache shared by all Streamlit sessions.
+# normalized question -> {"sql", "embedding", "literals", "created_at"}
+_entries = OrderedDict()
+_lock = threading.Lock()
+_schema_version = None
+_stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def normalize_question(question: str) -> str:
+    """Lowercases the question and collapses whitespace and trailing punctuation."""
+    normalized = re.sub(r"\s+", " ", question.strip().lower())
+    return normalized.rstrip(" ?.!")
+
+_NUMBER_WORDS = (
+    "one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|fifteen|twenty|"
+    "thirty|fifty|hundred|thousand|million"
+)
+_LITERAL = re.compile(
+    r"'[^']*'|\"[^\"]*\"|\d+(?:[.,]\d+)*|\b(?:" + _NUMBER_WORDS + r")\b|\b[A-Z][\w'-]*",
+)
+
+def _literals(question: str):
+    """
+    The values a question's SQL depends on: numbers, quoted strings and
+    capitalized words (names) after the first word. Questions that differ only
+    in these ("top 5" vs "top 10") embed almost identically.
+    """
+    first, _, rest = question.strip().partition(" ")
+    found = [match.group(0) for match in _LITERAL.finditer(rest)]
+    found += [match.group(0) for match in _LITERAL.finditer(first) if not match.group(0)[0].isupper()]
+    return frozenset(value.strip("'\"").lower() for value in found)
+
+def _embed(normalized: str):
+    return embedding_provider.encode(normalized, normalize_embeddings=True)
+
+def _schema_version_now():
+    # May query the database, so callers take it before acquiring _lock.
+    version = schema_provider.get_schema_fingerprint()
+    if version is None:
+        # Database not reachable: fall back to the schema file's modification time.
+        try:
+            version = os.path.getmtime(helpers.SCHEMA_FILE)
+        except OSError:
+            version = None
+    return version
+
+def _check_schema(version):
+    """Clears the cache when the database schema has changed since it was filled. Call under _lock."""
+    global _schema_version
+    if version != _schema_version:
+        if _entries:
+            _entries.clear()
+            _stats["invalidations"] += 1
+        _schema_version = version
+
+def _evict_expired(now: float):
+    ttl = settings.QUERY_CACHE_TTL_SECONDS
+    expired = [key for key, entry in _entries.items() if now - entry["created_at"] > ttl]
+    for key in expired:
+        del _entries[key]
+        _stats["evictions"] += 1
+
+def get(question: str):
+    """
+    Returns cached SQL for an exact (normalized) repeat of the question or for a
+    near-duplicate above the similarity threshold, otherwise None. Near-duplicates
+    must mention the same literals (numbers, quoted strings, names).
+    """
+    if not settings.QUERY_CACHE_ENABLED:
+        return None
+
+    normalized = normalize_question(question)
+    version = _schema_version_now()
+    with _lock:
+        _check_schema(version)
+        _evict_expired(time.time())
+        entry = _entries.get(normalized)
+        if entry is not None:
+            _entries.move_to_end(normalized)
+            _stats["exact_hits"] += 1
+            return entry["sql"]
+        literals = _literals(question)
+        keys = [key for key, candidate in _entries.items() if candidate["literals"] == literals]
+        if not keys:
+            _stats["misses"] += 1
+            return None
+        matrix = np.stack([_entries[key]["embedding"] for key in keys])
+
+    # Encoding happens outside the lock so sessions don't serialize on the model.
+    similarities = matrix @ _embed(normalized)
+    best = int(np.argmax(similarities))
+
+    with _lock:
+        entry = _entries.get(keys[best])
+        if entry is not None and similarities[best] >= settings.QUERY_CACHE_SIMILARITY_THRESHOLD:
+            _entries.move_to_end(keys[best])
+            _stats["semantic_hits"] += 1
+            print(f"Query cache: semantic hit ({similarities[best]:.3f}) on '{keys[best]}'.")
+            return entry["sql"]
+        _stats["misses"] += 1
+    return None
+
+def put(question: str, sql_query: str):
+    """Stores the generated SQL for a question, evicting the least recently used entry if full."""
+    if not settings.QUERY_CACHE_ENABLED:
+        return
+
+    normalized = normalize_question(question)
+    embedding = _embed(normalized)
+    version = _schema_version_now()
+    with _lock:
+        _check_schema(version)
+        _entries[normalized] = {
+            "sql": sql_query, "embedding": embedding, "literals": _literals(question), "created_at": time.time(),
+        }
+        _entries.move_to_end(normalized)
+        while len(_entries) > settings.QUERY_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+def clear():
+    """Drops every cached entry."""
+    with _lock:
+        _entries.clear()
+        _stats["invalidations"] += 1
+
+def get_stats():
+    """Returns hit/miss counters and the current cache size."""
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+    lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,114 @@
+import json
+import pyarrow as pa
+from sqlalchemy import text
+from config import database, settings
+from models import cost_guard, result_cache, single_flight
+from utils import tracing
+
+def check_query(sql_query: str):
+    """
+    Runs the cost guard on the query's EXPLAIN plan and returns its warnings.
+    Raises cost_guard.QueryCostError when the plan is rejected.
+    """
+    engine = database.get_db_engine()
+    with engine.begin() as connection:
+        _set_statement_timeout(connection)
+        return cost_guard.check_query_cost(connection, sql_query)
+
+def _set_statement_timeout(connection):
+    if settings.QUERY_STATEMENT_TIMEOUT_MS > 0:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.QUERY_STATEMENT_TIMEOUT_MS)}")
+
+def _rows_to_batch(columns, rows):
+    arrays = [pa.array(values) for values in zip(*rows)]
+    return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+def iter_record_batches(sql_query: str, first_page_rows: int = None, chunk_rows: int = None):
+    """
+    Streams the query's result from a server-side (named) cursor and yields it as
+    pyarrow RecordBatches: a small first page, then chunks of `chunk_rows`.
+    Columns holding embeddings are never converted.
+
+    The query runs in its own transaction with a per-query statement_timeout,
+    which stays open until the generator is exhausted or closed.
+    """
+    first_page_rows = first_page_rows or settings.RESULT_FIRST_PAGE_ROWS
+    chunk_rows = chunk_rows or settings.RESULT_FETCH_CHUNK_ROWS
+
+    engine = database.get_db_engine()
+    with engine.begin() as connection:
+        _set_statement_timeout(connection)
+        result = connection.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(sql_query))
+
+        columns = list(result.keys())
+        keep = [i for i, column in enumerate(columns) if 'embedding' not in column]
+        kept_columns = [columns[i] for i in keep]
+
+        rows = result.fetchmany(first_page_rows)
+        if not rows:
+            yield pa.RecordBatch.from_arrays([pa.array([], type=pa.null()) for _ in keep], names=kept_columns)
+            return
+        while rows:
+            yield _rows_to_batch(kept_columns, [[row[i] for i in keep] for row in rows])
+            rows = result.fetchmany(chunk_rows)
+
+def batches_to_table(batches):
+    """Combines record batches into one Table, unifying types that differ between batches (all-null columns, decimal widths)."""
+    tables = [pa.Table.from_batches([batch]) for batch in batches]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+def execute_query(sql_query: str, on_first_page=None):
+    """
+    Executes a validated SQL query and returns (pyarrow.Table, warnings, from_cache).
+
+    Results are served from the shared result cache when the tables they read
+    haven't changed. Otherwise the cost guard runs first, the result is streamed
+    and `on_first_page` (if given) receives the first batch as soon as it
+    arrives. Raises cost_guard.QueryCostError when the plan is rejected.
+
+    Concurrent executions of the same SQL from other sessions share one run
+    and its first page (the result is reported as from_cache).
+    """
+    (table, warnings, from_cache), shared = single_flight.run(
+        "sql",
+        result_cache.normalize_sql(sql_query),
+        lambda progress: _execute_query(sql_query, progress),
+        serializer=(_dump_result, _load_result),
+        on_progress=on_first_page,
+    )
+    if shared:
+        tracing.annotate(coalesced_execution=True)
+    return table, warnings, from_cache or shared
+
+def _dump_result(result):
+    table, warnings, _ = result
+    return json.dumps(warnings).encode("utf-8") + b"\n" + result_cache.serialize_table(table)
+
+def _load_result(data):
+    header, _, body = data.partition(b"\n")
+    return result_cache.deserialize_table(body), json.loads(header), True
+
+def _execute_query(sql_query: str, on_first_page=None):
+    with tracing.span("result_cache"):
+        table = result_cache.get(sql_query)
+    if settings.RESULT_CACHE_ENABLED:
+        tracing.record_cache("result", table is not None)
+    if table is not None:
+        return table, [], True
+
+    with tracing.span("cost_guard") as span:
+        warnings = check_query(sql_query)
+        span["warnings"] = len(warnings)
+    batches = []
+    with tracing.span("db_execution") as span:
+        for batch in iter_record_batches(sql_query):
+            # Closing the generator on cancellation closes the cursor too.
+            single_flight.check_cancelled()
+            batches.append(batch)
+            if len(batches) == 1 and on_first_page is not None:
+                on_first_page(batch)
+        table = batches_to_table(batches)
+        span["rows"] = table.num_rows
+        span["batches"] = len(batches)
+    result_cache.put(sql_query, table)
+    return table, warnings, False
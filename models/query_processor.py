@@ -1,77 +1,115 @@
-import openai
 import json
 from sqlalchemy import text
 from config import settings
-from utils import helpers
-from models import sql_validator, vector_search
+from utils import helpers, tracing
+from models import entity_gazetteer, query_cache, schema_provider, single_flight, sql_validator, vector_search
 
-# Set the OpenAI API key
-openai.api_key = settings.OPENAI_API_KEY
+_openai = None
 
-def _extract_entities_from_query(query: str):
-    """
-    Uses an LLM to identify fuzzy entities (product, employee, or customer names)
-    from the user's query.
-    """
+def _get_openai():
+    """Imports and configures the OpenAI client on first use."""
+    global _openai
+    if _openai is None:
+        import openai
+        openai.api_key = settings.require_openai_api_key()
+        _openai = openai
+    return _openai
+
+# Maps the keys returned by the entity-extraction prompt to vector_search entity types.
+ENTITY_KEYS = {
+    "employee_names": "employee",
+    "product_names": "product",
+    "customer_names": "customer",
+}
+
+def _entity_extraction_messages(query: str):
     prompt = f"""
     You are an expert at extracting entities from user questions.
-    Analyze the user question and extract any product names, employee names, or customer names.
+    Analyze the user question and extract every product name, employee name, and customer name it mentions.
     
-    Return a JSON object with keys "product_name", "employee_name", and "customer_name".
-    If an entity is not found, its value should be null.
+    Return a JSON object with keys "product_names", "employee_names", and "customer_names".
+    Each value must be a list of strings. If no entity of a kind is found, use an empty list.
 
     User Question: "{query}"
     
     JSON Response:
     """
+    return [{"role": "user", "content": prompt}]
+
+def _parse_entities(content: str):
+    """Normalizes the extraction response into a dict of entity type -> list of names."""
+    raw_entities = json.loads(content)
+    entities = {}
+    for key, entity in ENTITY_KEYS.items():
+        values = raw_entities.get(key) or []
+        if isinstance(values, str):
+            values = [values]
+        values = [value for value in values if isinstance(value, str) and value.strip()]
+        if values:
+            entities[entity] = values
+    return entities
+
+def _extract_entities_from_query(query: str):
+    """
+    Uses an LLM to identify fuzzy entities (product, employee, or customer names)
+    from the user's query. Returns a dict of entity type -> list of names.
+    """
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"},
-            temperature=0.0,
-        )
-        return json.loads(response.choices[0].message.content)
+        with tracing.span("entity_extraction"):
+            response = _get_openai().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=_entity_extraction_messages(query),
+                response_format={"type": "json_object"},
+                temperature=0.0,
+            )
+            tracing.record_tokens("entity_extraction", response.usage)
+        return _parse_entities(response.choices[0].message.content)
     except Exception:
         return {}
 
-def process_natural_language_query(query: str):
+def _extract_entities(query: str):
     """
-    Takes a natural language query and converts it to a validated SQL query
-    using a true hybrid search approach.
+    Extracts entities locally when the gazetteer is confident, and falls back to
+    the LLM only when the question may contain a fuzzy name.
     """
-    print(f"Received query: '{query}'")
-    enriched_query = query
-    
-    entities = _extract_entities_from_query(query)
-    
-    if entities.get("employee_name"):
-        entity = entities["employee_name"]
-        print(f"Fuzzy employee entity found: '{entity}'. Performing vector search...")
-        similar_items = vector_search.find_similar_employees(entity)
-        if similar_items:
-            item_id, item_name = similar_items[0]
-            enriched_query = f"{query} (clarification: use employee with id {item_id} whose name is '{item_name}')"
-    
-    elif entities.get("product_name"):
-        entity = entities["product_name"]
-        print(f"Fuzzy product entity found: '{entity}'. Performing vector search...")
-        similar_items = vector_search.find_similar_products(entity)
-        if similar_items:
-            item_id, item_name = similar_items[0]
-            enriched_query = f"{query} (clarification: use product with id {item_id} whose name is '{item_name}')"
-
-    elif entities.get("customer_name"):
-        entity = entities["customer_name"]
-        print(f"Fuzzy customer entity found: '{entity}'. Performing vector search...")
-        similar_items = vector_search.find_similar_customers(entity)
-        if similar_items:
-            item_id, item_name = similar_items[0]
-            enriched_query = f"{query} (clarification: use order involving customer '{item_name}' with order id {item_id})"
+    entities = _prefilter_entities(query)
+    if entities is not None:
+        return entities
+    return _extract_entities_from_query(query)
 
-    print(f"Enriched query for SQL generation: '{enriched_query}'")
+def _prefilter_entities(query: str):
+    """Returns locally extracted entities, or None when the LLM has to decide."""
+    with tracing.span("entity_prefilter") as span:
+        analysis = entity_gazetteer.analyze(query)
+        span["needs_llm"] = analysis is None or analysis["needs_llm"]
+    if analysis is not None and not analysis["needs_llm"]:
+        print(f"Entity pre-filter: skipping LLM extraction ({analysis['reason']}).")
+        return analysis["entities"]
+    if analysis is not None:
+        print(f"Entity pre-filter: forwarding to LLM ({analysis['reason']}).")
+    return None
 
-    schema = helpers.get_schema_definition()
+def _build_clarifications(resolved: dict):
+    """Turns the best vector-search candidate for each entity into a prompt clarification."""
+    clarifications = []
+    for entity, matches in resolved.items():
+        for match in matches:
+            if not match["candidates"]:
+                continue
+            item_id, item_name, _ = match["candidates"][0]
+            if entity == "customer":
+                clarifications.append(f"use orders whose customer_name is '{item_name}'")
+            else:
+                clarifications.append(f"use {entity} with id {item_id} whose name is '{item_name}'")
+    return clarifications
+
+def _enrich_query(query: str, resolved: dict):
+    clarifications = _build_clarifications(resolved)
+    if clarifications:
+        return f"{query} (clarification: {'; '.join(clarifications)})"
+    return query
+
+def _sql_generation_messages(schema: str, enriched_query: str):
     prompt = f"""
     ### Instructions
     You are an expert PostgreSQL assistant. Your task is to translate the user's question into a valid and secure PostgreSQL query.
@@ -89,24 +127,135 @@ def process_natural_language_query(query: str):
 
     ### SQL Query
     """
-    
+    return [
+        {"role": "system", "content": "You are a PostgreSQL expert that translates natural language to SQL."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _finalize_sql(query: str, raw_response: str):
+    """Extracts, validates and limits the generated SQL, caching it on success."""
+    with tracing.span("validation") as span:
+        sql_query = helpers.extract_sql_from_response(raw_response.strip())
+
+        span["safe"] = sql_validator.is_query_safe(sql_query)
+        if not span["safe"]:
+            return "Error: The generated query is not safe to execute."
+
+        final_sql = sql_validator.sanitize_and_limit_query(sql_query, schema_provider.get_table_columns())
+    query_cache.put(query, final_sql)
+    return final_sql
+
+def _stream_sql_generation(messages, on_partial_sql):
+    """
+    Streams the SQL-generation completion, passing the text received so far to
+    `on_partial_sql`. Stops reading as soon as the partial SQL is unsafe or the
+    statement is complete. Returns (raw_response, is_safe).
+    """
+    stream = _get_openai().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.0,
+        max_tokens=500,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    raw_response = ""
+    status = "incomplete"
+    try:
+        for chunk in stream:
+            # Usage arrives in a final chunk without choices, unless we stop early.
+            tracing.record_tokens("sql_generation", getattr(chunk, "usage", None))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            raw_response += delta
+            on_partial_sql(raw_response)
+            status = sql_validator.check_partial_query(raw_response)
+            if status != "incomplete":
+                break
+    finally:
+        # Closing the stream stops token generation we would otherwise pay for.
+        stream.close()
+
+    if status == "unsafe":
+        print(f"Aborted SQL generation after {len(raw_response)} characters.")
+    return raw_response, status != "unsafe"
+
+def process_natural_language_query(query: str, on_partial_sql=None):
+    """
+    Takes a natural language query and converts it to a validated SQL query
+    using a true hybrid search approach.
+
+    When `on_partial_sql` is given, the SQL is streamed and the callback receives
+    the text generated so far, so the UI can show it as it arrives.
+
+    Concurrent identical questions (after normalization) from other sessions
+    share one generation, whose partial SQL reaches each of their callbacks.
+    """
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a PostgreSQL expert that translates natural language to SQL."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0,
-            max_tokens=500
+        sql_query, shared = single_flight.run(
+            "question",
+            query_cache.normalize_question(query),
+            lambda progress: _process_query(query, progress if on_partial_sql is not None else None),
+            serializer=single_flight.TEXT,
+            on_progress=on_partial_sql,
         )
-        raw_response = response.choices[0].message.content.strip()
-        sql_query = helpers.extract_sql_from_response(raw_response)
-        
-        if not sql_validator.is_query_safe(sql_query):
-            return "Error: The generated query is not safe to execute."
-        
-        return sql_validator.sanitize_and_limit_query(sql_query)
+    except TimeoutError as e:
+        return f"Error: {e}"
+    if shared:
+        print("Shared the SQL of an identical question already in progress.")
+        tracing.annotate(coalesced=True)
+    return sql_query
+
+def _process_query(query: str, on_partial_sql=None):
+    print(f"Received query: '{query}'")
+
+    with tracing.span("query_cache"):
+        cached_sql = query_cache.get(query)
+    if settings.QUERY_CACHE_ENABLED:
+        tracing.record_cache("query", cached_sql is not None)
+    if cached_sql is not None:
+        print("Query cache hit. Skipping LLM calls.")
+        return cached_sql
+
+    enriched_query = query
+    
+    single_flight.check_cancelled()
+    entities = _extract_entities(query)
+    
+    if entities:
+        print(f"Fuzzy entities found: {entities}. Performing vector search...")
+        try:
+            resolved = vector_search.find_similar_entities(entities, top_k=settings.ENTITY_TOP_K)
+        except Exception as e:
+            print(f"Vector search failed: {e}")
+            resolved = {}
+        enriched_query = _enrich_query(query, resolved)
+
+    print(f"Enriched query for SQL generation: '{enriched_query}'")
+
+    with tracing.span("schema_load"):
+        schema = schema_provider.get_prompt_schema(query)
+    
+    # Nobody is waiting for this question any more: skip the LLM call.
+    single_flight.check_cancelled()
+    try:
+        messages = _sql_generation_messages(schema, enriched_query)
+        if on_partial_sql is not None:
+            with tracing.span("sql_generation", streamed=True):
+                raw_response, is_safe = _stream_sql_generation(messages, on_partial_sql)
+            if not is_safe:
+                return "Error: The generated query is not safe to execute."
+            return _finalize_sql(query, raw_response)
+
+        with tracing.span("sql_generation", streamed=False):
+            response = _get_openai().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.0,
+                max_tokens=500
+            )
+            tracing.record_tokens("sql_generation", response.usage)
+        return _finalize_sql(query, response.choices[0].message.content)
     except Exception as e:
         return f"Error: An unexpected error occurred: {e}"
-
@@ -0,0 +1,176 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import pyarrow as pa
+from sqlalchemy import text
+from config import database, settings
+from models import sql_validator
+
+# Process-wide cache of executed results, shared by all Streamlit sessions.
+# normalized SQL -> {"data": Arrow IPC bytes, "tables": {table: version}, "stored_at": time}
+_entries = OrderedDict()
+_size_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+# Per-table versions. The database part comes from pg_stat_user_tables
+# modification counters; the local part is bumped by bump_table_version() for
+# writes made by this process.
+_local_versions = {}
+_db_versions = {}
+_db_versions_checked_at = 0.0
+_db_versions_failed_at = 0.0
+_versions_lock = threading.Lock()
+# After a failed version check, the cache is bypassed this long before retrying.
+VERSION_CHECK_BACKOFF_SECONDS = 30
+
+# Results of these depend on the clock or are random: never cached.
+_VOLATILE = re.compile(
+    r"\b(now|current_date|current_time|current_timestamp|localtime|localtimestamp|clock_timestamp|"
+    r"statement_timestamp|transaction_timestamp|timeofday|random|gen_random_uuid|nextval)\b",
+    re.IGNORECASE,
+)
+
+def normalize_sql(sql_query: str) -> str:
+    """Cache key for a query: its canonical form, or the exact text when it doesn't parse."""
+    try:
+        return sql_validator.canonical_sql(sql_query)
+    except ValueError:
+        return sql_query.strip()
+
+def bump_table_version(table: str):
+    """Invalidates every cached result that reads `table`."""
+    with _lock:
+        _local_versions[table] = _local_versions.get(table, 0) + 1
+
+def _versions_are_fresh():
+    return time.time() - _db_versions_checked_at < settings.RESULT_CACHE_VERSION_CHECK_SECONDS
+
+def _refresh_db_versions():
+    """
+    Re-reads the modification counters when they are older than
+    RESULT_CACHE_VERSION_CHECK_SECONDS. Runs outside the cache lock; one thread
+    queries while the others wait for it. Raises while backing off from a failure.
+    """
+    global _db_versions, _db_versions_checked_at, _db_versions_failed_at
+    if _versions_are_fresh():
+        return
+    with _versions_lock:
+        if _versions_are_fresh():
+            return
+        if time.time() - _db_versions_failed_at < VERSION_CHECK_BACKOFF_SECONDS:
+            raise RuntimeError("table versions unavailable, retrying after a failed check")
+        try:
+            engine = database.get_db_engine()
+            with engine.connect() as connection:
+                rows = connection.execute(text(
+                    "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del, n_live_tup FROM pg_stat_user_tables"
+                )).fetchall()
+        except Exception:
+            _db_versions_failed_at = time.time()
+            raise
+        _db_versions = {name: (int(modifications), int(live)) for name, modifications, live in rows}
+        _db_versions_checked_at = time.time()
+
+def _current_versions(tables):
+    return {table: (_db_versions.get(table), _local_versions.get(table, 0)) for table in tables}
+
+def is_cacheable(sql_query: str, tables) -> bool:
+    """Only queries that read tables and call no clock or random functions are cached."""
+    return bool(tables) and not _VOLATILE.search(sql_query)
+
+def serialize_table(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def deserialize_table(data: bytes) -> pa.Table:
+    return pa.ipc.open_stream(data).read_all()
+
+def _remove(key):
+    global _size_bytes
+    entry = _entries.pop(key)
+    _size_bytes -= len(entry["data"])
+
+def get(sql_query: str):
+    """Returns the cached result Table for the query, or None if absent or stale."""
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    key = normalize_sql(sql_query)
+    with _lock:
+        if key not in _entries:
+            _stats["misses"] += 1
+            return None
+    try:
+        _refresh_db_versions()
+    except Exception as e:
+        print(f"Result cache: could not read table versions: {e}")
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        expired = settings.RESULT_CACHE_TTL_SECONDS > 0 and time.time() - entry["stored_at"] > settings.RESULT_CACHE_TTL_SECONDS
+        if expired or _current_versions(entry["tables"]) != entry["tables"]:
+            _remove(key)
+            _stats["stale"] += 1
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        data = entry["data"]
+    return deserialize_table(data)
+
+def put(sql_query: str, table: pa.Table):
+    """Stores a result, evicting least recently used entries to stay within the memory budget."""
+    global _size_bytes
+    if not settings.RESULT_CACHE_ENABLED:
+        return
+    key = normalize_sql(sql_query)
+    try:
+        tables = sql_validator.get_referenced_tables(sql_query)
+    except ValueError:
+        return
+    if not is_cacheable(sql_query, tables):
+        return
+    data = serialize_table(table)
+    # A single result may use at most a quarter of the budget.
+    if len(data) > settings.RESULT_CACHE_MAX_BYTES // 4:
+        return
+    try:
+        _refresh_db_versions()
+    except Exception as e:
+        print(f"Result cache: could not read table versions: {e}")
+        return
+    with _lock:
+        versions = _current_versions(tables)
+        if key in _entries:
+            _remove(key)
+        _entries[key] = {"data": data, "tables": versions, "stored_at": time.time()}
+        _size_bytes += len(data)
+        while _size_bytes > settings.RESULT_CACHE_MAX_BYTES:
+            _remove(next(iter(_entries)))
+            _stats["evictions"] += 1
+
+def clear():
+    """Drops every cached result."""
+    global _size_bytes
+    with _lock:
+        _entries.clear()
+        _size_bytes = 0
+
+def get_stats():
+    """Returns hit/miss counters and memory use."""
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["size_bytes"] = _size_bytes
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
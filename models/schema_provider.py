@@ -0,0 +1,202 @@
+import threading
+import time
+import numpy as np
+from sqlalchemy import text
+from config import database, settings
+from utils import embedding_provider, helpers
+
+# pgvector column types. These are never useful in a result set or a prompt.
+VECTOR_TYPES = {"vector", "halfvec", "sparsevec"}
+
+_CATALOG_SQL = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), t.typname, a.attnotnull,
+           col_description(c.oid, a.attnum), obj_description(c.oid, 'pg_class')
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'v', 'm')
+    ORDER BY c.relname, a.attnum
+"""
+
+_CONSTRAINTS_SQL = """
+    SELECT cl.relname, con.contype,
+           ARRAY(SELECT a.attname::text FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum ORDER BY k.ord),
+           ref.relname,
+           ARRAY(SELECT a.attname::text FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum ORDER BY k.ord)
+    FROM pg_constraint con
+    JOIN pg_class cl ON cl.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = cl.relnamespace
+    LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+    WHERE n.nspname = current_schema() AND con.contype IN ('p', 'f')
+"""
+
+# A cheap fingerprint of the schema's tables, columns and constraints. It only
+# changes on DDL, so it is used to decide when to reload the catalog.
+_SIGNATURE_SQL = """
+    SELECT md5(coalesce(string_agg(c.relname || '.' || a.attname || ':' || a.atttypid || ':' || a.attnotnull, ','
+                                   ORDER BY c.relname, a.attnum), '')
+               || (SELECT count(*) FROM pg_constraint con JOIN pg_namespace cn ON cn.oid = con.connamespace
+                   WHERE cn.nspname = current_schema())::text)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'v', 'm')
+"""
+
+# {"signature", "tables": {table: {...}}, "embeddings": (names, matrix) or None}
+_catalog = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def _load_catalog(connection, signature):
+    tables = {}
+    for table, column, data_type, udt_name, not_null, column_comment, table_comment in connection.execute(text(_CATALOG_SQL)):
+        entry = tables.setdefault(table, {"columns": [], "primary_key": [], "foreign_keys": [], "comment": table_comment})
+        entry["columns"].append({
+            "name": column,
+            "type": data_type,
+            "not_null": not_null,
+            "is_vector": udt_name in VECTOR_TYPES,
+            "comment": column_comment,
+        })
+
+    for table, contype, columns, ref_table, ref_columns in connection.execute(text(_CONSTRAINTS_SQL)):
+        if table not in tables:
+            continue
+        if contype == "p":
+            tables[table]["primary_key"] = columns
+        else:
+            tables[table]["foreign_keys"].append({"columns": columns, "ref_table": ref_table, "ref_columns": ref_columns})
+
+    return {"signature": signature, "tables": tables, "embeddings": None}
+
+def _get_catalog():
+    """
+    Returns the cached catalog, checking the schema fingerprint at most every
+    SCHEMA_CACHE_SECONDS and reloading only when DDL has changed it.
+    """
+    global _catalog, _checked_at
+    now = time.time()
+    if _catalog is not None and now - _checked_at < settings.SCHEMA_CACHE_SECONDS:
+        return _catalog
+    with _lock:
+        if _catalog is None or now - _checked_at >= settings.SCHEMA_CACHE_SECONDS:
+            try:
+                engine = database.get_db_engine()
+                with engine.connect() as connection:
+                    signature = connection.execute(text(_SIGNATURE_SQL)).scalar()
+                    if _catalog is None or signature != _catalog["signature"]:
+                        if _catalog is not None:
+                            print("Schema change detected. Reloading catalog.")
+                        _catalog = _load_catalog(connection, signature)
+            except Exception as e:
+                print(f"Could not introspect database schema: {e}")
+            _checked_at = now
+    return _catalog
+
+def get_schema_fingerprint():
+    """Returns a value that changes whenever the live schema changes (None if unavailable)."""
+    catalog = _get_catalog()
+    return catalog["signature"] if catalog else None
+
+def get_table_columns():
+    """
+    Returns {table: [(column, is_vector), ...]} for the current schema, in
+    ordinal order, or {} if the database cannot be reached.
+    """
+    catalog = _get_catalog()
+    if not catalog:
+        return {}
+    return {
+        table: [(column["name"], column["is_vector"]) for column in entry["columns"]]
+        for table, entry in catalog["tables"].items()
+    }
+
+def _table_ddl(table: str, entry: dict) -> str:
+    """A compact one-table summary, e.g. employees(id integer PK, department_id integer -> departments.id)."""
+    references = {}
+    for fk in entry["foreign_keys"]:
+        for column, ref_column in zip(fk["columns"], fk["ref_columns"]):
+            references[column] = f"{fk['ref_table']}.{ref_column}"
+
+    parts = []
+    for column in entry["columns"]:
+        if column["is_vector"]:
+            continue
+        part = f"{column['name']} {column['type']}"
+        if column["name"] in entry["primary_key"]:
+            part += " PK"
+        elif column["not_null"]:
+            part += " NOT NULL"
+        if column["name"] in references:
+            part += f" -> {references[column['name']]}"
+        if column["comment"]:
+            part += f" /* {column['comment']} */"
+        parts.append(part)
+
+    ddl = f"{table}({', '.join(parts)})"
+    if entry["comment"]:
+        ddl = f"-- {entry['comment']}\n{ddl}"
+    return ddl
+
+def _table_description(table: str, entry: dict) -> str:
+    columns = ", ".join(column["name"].replace("_", " ") for column in entry["columns"] if not column["is_vector"])
+    description = f"table {table.replace('_', ' ')} with columns {columns}"
+    if entry["comment"]:
+        description += f". {entry['comment']}"
+    return description
+
+def _rank_tables(catalog: dict, question: str):
+    if catalog["embeddings"] is None:
+        names = sorted(catalog["tables"])
+        descriptions = [_table_description(name, catalog["tables"][name]) for name in names]
+        matrix = embedding_provider.encode(descriptions, normalize_embeddings=True, use_cache=False)
+        catalog["embeddings"] = (names, matrix)
+
+    names, matrix = catalog["embeddings"]
+    scores = matrix @ embedding_provider.encode(question, normalize_embeddings=True)
+    return [names[i] for i in np.argsort(-scores)]
+
+def select_tables(question: str):
+    """
+    Returns the tables relevant to the question: all of them for small schemas,
+    otherwise the SCHEMA_MAX_TABLES best matches by embedding similarity plus
+    tables named in the question and the tables they reference.
+    """
+    catalog = _get_catalog()
+    if not catalog:
+        return []
+    tables = catalog["tables"]
+    if len(tables) <= settings.SCHEMA_MAX_TABLES or not question:
+        return sorted(tables)
+
+    lowered = question.lower()
+    selected = [name for name in tables if name.lower() in lowered or name.lower().rstrip("s") in lowered]
+    for name in _rank_tables(catalog, question):
+        if len(selected) >= settings.SCHEMA_MAX_TABLES:
+            break
+        if name not in selected:
+            selected.append(name)
+
+    # Add the tables the selected ones reference, so their foreign keys can be joined.
+    referenced = {fk["ref_table"] for name in selected for fk in tables[name]["foreign_keys"]}
+    return selected + sorted(name for name in referenced - set(selected) if name in tables)
+
+def get_prompt_schema(question: str = None):
+    """
+    Returns a compact schema summary for the prompt, pruned to the tables
+    relevant to the question. Falls back to sql/schema.sql if the database
+    can't be introspected.
+    """
+    catalog = _get_catalog()
+    if not catalog or not catalog["tables"]:
+        return helpers.get_schema_definition()
+    try:
+        names = select_tables(question)
+    except Exception as e:
+        print(f"Could not rank schema tables: {e}")
+        names = sorted(catalog["tables"])
+    return "\n".join(_table_ddl(name, catalog["tables"][name]) for name in names)
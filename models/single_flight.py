@@ -0,0 +1,235 @@
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from config import settings
+from utils import tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process coalescing is unavailable.
+    fcntl = None
+
+# Coalesces concurrent identical work (the same normalized question, the same
+# final SQL) across Streamlit sessions. The computation runs once, on a worker
+# thread of its own, and every caller with the same key (the one that started
+# it included) is a waiter. Progress the computation publishes (partial SQL, a
+# first page of rows) is handed to each waiter's own callback on the waiter's
+# own thread, so every session can stream it to its UI. Waiters are counted:
+# when the last one leaves (its script run stopped, or it timed out) the
+# computation is cancelled at its next check_cancelled() or progress update.
+#
+# With SINGLE_FLIGHT_LOCK_DIR set, computations in different processes also
+# coalesce: they serialize on a file lock, and a process that waited for the
+# lock reuses the result the previous holder wrote for its key. Keys share a
+# fixed set of LOCK_STRIPES lock files, which are never deleted: unlinking a
+# lock file another process holds would let two processes lock the same path.
+
+TEXT = (lambda value: value.encode("utf-8"), lambda data: data.decode("utf-8"))
+
+_flights = {}
+_lock = threading.Lock()
+_stats = {"computations": 0, "followers": 0, "cancelled": 0, "timeouts": 0, "cross_process_reused": 0}
+_last_cleanup = 0.0
+_current = contextvars.ContextVar("single_flight", default=None)
+# Result files older than this are never reused and are removed.
+RESULT_FILE_MAX_AGE_SECONDS = 300
+LOCK_STRIPES = 256
+
+class Cancelled(Exception):
+    """Raised inside a computation once every caller waiting for it has left."""
+
+class _Flight:
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.finished = False
+        self.result = None
+        self.shared = False
+        self.error = None
+        self.cancelled = False
+        self.waiters = 0
+        self.progress = None
+        self.version = 0
+
+    def publish(self, value):
+        if self.cancelled:
+            raise Cancelled()
+        with self.changed:
+            self.progress = value
+            self.version += 1
+            self.changed.notify_all()
+
+def check_cancelled():
+    """Raises Cancelled when called from a computation nobody is waiting for any more."""
+    flight = _current.get()
+    if flight is not None and flight.cancelled:
+        raise Cancelled()
+
+def run(namespace: str, key: str, compute, timeout: float = None, serializer=None, on_progress=None):
+    """
+    Runs `compute(progress)` once for all concurrent callers with the same
+    namespace and key. Returns (result, shared), where `shared` is True when
+    the computation was started by another caller (or another process).
+
+    Values the computation passes to `progress` reach every caller's
+    `on_progress`; a caller joining late gets the latest one. Callers that
+    joined an existing computation raise TimeoutError after `timeout` seconds
+    (default SINGLE_FLIGHT_TIMEOUT_SECONDS). `serializer` is a (dumps, loads)
+    pair to bytes that enables cross-process sharing.
+    """
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return compute(on_progress or (lambda value: None)), False
+    timeout = settings.SINGLE_FLIGHT_TIMEOUT_SECONDS if timeout is None else timeout
+    flight_key = (namespace, key)
+
+    with _lock:
+        flight = _flights.get(flight_key)
+        started = flight is None
+        if started:
+            flight = _flights[flight_key] = _Flight()
+        flight.waiters += 1
+    if started:
+        _record("computations", namespace)
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run,
+            args=(_compute, namespace, key, flight, compute, serializer, time.monotonic() + timeout),
+            name=f"single-flight-{namespace}",
+            daemon=True,
+        ).start()
+
+    finished = False
+    try:
+        if started:
+            finished = _wait(flight, on_progress, None)
+        else:
+            with tracing.span("single_flight_wait", namespace=namespace):
+                finished = _wait(flight, on_progress, time.monotonic() + timeout)
+    finally:
+        _leave(namespace, flight_key, flight)
+
+    if not finished:
+        _record("timeouts", namespace)
+        raise TimeoutError(f"Timed out after {timeout:.0f}s waiting for an identical {namespace} already in progress.")
+    if not started:
+        _record("followers", namespace)
+    if flight.error is not None:
+        raise flight.error
+    return flight.result, flight.shared or not started
+
+def _wait(flight, on_progress, deadline):
+    # Returns True once the computation finished, False at the deadline.
+    seen = 0
+    while True:
+        with flight.changed:
+            while flight.version == seen and not flight.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                flight.changed.wait(remaining)
+            version, progress, finished = flight.version, flight.progress, flight.finished
+        # Callbacks run outside the condition, on the waiter's own thread.
+        if version != seen:
+            seen = version
+            if on_progress is not None:
+                on_progress(progress)
+        if finished:
+            return True
+
+def _leave(namespace, flight_key, flight):
+    with _lock:
+        flight.waiters -= 1
+        if flight.waiters > 0 or flight.finished:
+            return
+        flight.cancelled = True
+        # Later callers start a fresh computation instead of joining this one.
+        if _flights.get(flight_key) is flight:
+            del _flights[flight_key]
+    _record("cancelled", namespace)
+
+def _compute(namespace, key, flight, compute, serializer, deadline):
+    _current.set(flight)
+    try:
+        flight.result, flight.shared = _run_cross_process(
+            namespace, key, lambda: compute(flight.publish), serializer, deadline
+        )
+    except BaseException as e:
+        flight.error = e
+    finally:
+        with _lock:
+            if _flights.get((namespace, key)) is flight:
+                del _flights[(namespace, key)]
+        with flight.changed:
+            flight.finished = True
+            flight.changed.notify_all()
+
+def _run_cross_process(namespace, key, compute, serializer, deadline):
+    lock_dir = settings.SINGLE_FLIGHT_LOCK_DIR
+    if not lock_dir or serializer is None or fcntl is None:
+        return compute(), False
+
+    os.makedirs(lock_dir, exist_ok=True)
+    name = hashlib.sha256(f"{namespace}\0{key}".encode("utf-8")).hexdigest()
+    lock_path = os.path.join(lock_dir, f"{int(name[:8], 16) % LOCK_STRIPES:03d}.lock")
+    result_path = os.path.join(lock_dir, f"{name}.result")
+    dumps, loads = serializer
+
+    started = time.time()
+    with open(lock_path, "a") as lock_file:
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = True
+                check_cancelled()
+                if time.monotonic() >= deadline:
+                    _record("timeouts", namespace)
+                    raise TimeoutError(f"Timed out waiting for the cross-process lock of this {namespace}.")
+                time.sleep(0.05)
+        try:
+            # Only a result finished while we were waiting belongs to the same burst.
+            if waited and os.path.exists(result_path) and os.path.getmtime(result_path) >= started:
+                with open(result_path, "rb") as f:
+                    data = f.read()
+                _record("cross_process_reused", namespace)
+                return loads(data), True
+
+            result = compute()
+            # A computation cut short by cancellation is not a result to share.
+            check_cancelled()
+            temp_path = f"{result_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(dumps(result))
+            os.replace(temp_path, result_path)
+            return result, False
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            _cleanup(lock_dir)
+
+def _cleanup(lock_dir):
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < 60:
+        return
+    _last_cleanup = now
+    for entry in os.scandir(lock_dir):
+        if not entry.name.endswith((".result", ".tmp")):
+            continue
+        try:
+            if now - entry.stat().st_mtime > RESULT_FILE_MAX_AGE_SECONDS:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def _record(event, namespace):
+    with _lock:
+        _stats[event] += 1
+    tracing.count("nlsql_single_flight_total", namespace=namespace, event=event)
+
+def get_stats():
+    """Returns counters for computations, coalesced followers, cancellations, timeouts and cross-process reuse."""
+    with _lock:
+        return {**_stats, "in_flight": len(_flights), "waiting": sum(f.waiters for f in _flights.values())}
@@ -1,50 +1,286 @@
-# A list of keywords that are not allowed in the generated SQL
+import re
+from functools import lru_cache
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from config import settings
+
+# A list of keywords that are not allowed in the generated SQL.
+# Used by the token-level check on streamed SQL; complete queries are validated
+# on the parsed statement instead.
 DENY_LIST = [
     "delete", "insert", "update", "drop", "alter", "truncate",
     "merge", "create", "grant", "revoke"
 ]
 
+# Statement and clause types that write data, change the schema or take locks.
+FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter,
+    exp.TruncateTable, exp.Grant, exp.Revoke, exp.Command, exp.Copy, exp.Set,
+    exp.Transaction, exp.Commit, exp.Rollback,
+    exp.Into,  # SELECT ... INTO creates a table
+    exp.Lock,  # SELECT ... FOR UPDATE / FOR SHARE
+)
+
+# Functions with side effects that are callable from a plain SELECT.
+DENY_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "set_config", "pg_terminate_backend",
+    "pg_cancel_backend", "pg_reload_conf", "lo_import", "lo_export", "lo_unlink",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "dblink", "dblink_exec", "nextval", "setval",
+}
+
 # a complexity limit
 MAX_JOINS = 3
 
 # a default result limit
-DEFAULT_LIMIT = 100
+DEFAULT_LIMIT = settings.DEFAULT_RESULT_LIMIT
+
+# the largest outer LIMIT a generated query may request
+MAX_LIMIT = max(settings.MAX_RESULT_LIMIT, DEFAULT_LIMIT)
+
+DIALECT = "postgres"
+
+@lru_cache(maxsize=512)
+def _parse(sql_query: str):
+    """
+    Parses the query once per distinct text. The returned trees are shared, so
+    callers must copy() them before modifying.
+    """
+    return tuple(statement for statement in sqlglot.parse(sql_query, read=DIALECT) if statement is not None)
+
+def _parse_single(sql_query: str):
+    """Returns the single parsed statement, or raises ValueError."""
+    try:
+        statements = _parse(sql_query.strip())
+    except ParseError as e:
+        raise ValueError(f"Query could not be parsed: {e}")
+    if len(statements) != 1:
+        raise ValueError(f"Expected exactly one statement, found {len(statements)}.")
+    return statements[0]
+
+def canonical_sql(sql_query: str) -> str:
+    """
+    Returns the query regenerated from its parse tree, so formatting differences
+    disappear while string literals stay exactly as written. Raises ValueError.
+    """
+    return _parse_single(sql_query).sql(dialect=DIALECT)
+
+def get_referenced_tables(sql_query: str):
+    """Returns the names of the base tables a query reads (CTE names excluded)."""
+    statement = _parse_single(sql_query)
+    cte_names = {cte.alias_or_name for cte in statement.find_all(exp.CTE)}
+    return {table.name for table in statement.find_all(exp.Table) if table.name and table.name not in cte_names}
 
 def is_query_safe(sql_query: str) -> bool:
     """
     Validates a SQL query to ensure it's safe to execute.
-    - Checks if the query starts with SELECT.
-    - Checks for any forbidden keywords from the DENY_LIST.
+    - Checks that it is a single read-only query (SELECT, set operation or CTE).
+    - Checks for statements, clauses and functions that write data or take locks.
     - Checks for an excessive number of JOINs.
     """
-    query_lower = sql_query.lower()
+    try:
+        statement = _parse_single(sql_query)
+    except ValueError as e:
+        print(f"Validation Failed: {e}")
+        return False
 
-    if not query_lower.strip().startswith("select"):
-        print("Validation Failed: Query does not start with SELECT.")
+    if not isinstance(statement, exp.Query):
+        print(f"Validation Failed: Query is a {statement.key.upper()} statement, not a SELECT.")
         return False
 
-    for keyword in DENY_LIST:
-        if keyword in query_lower:
-            print(f"Validation Failed: Query contains forbidden keyword '{keyword}'.")
+    for node in statement.walk():
+        if isinstance(node, FORBIDDEN_NODES):
+            print(f"Validation Failed: Query contains forbidden construct '{node.key.upper()}'.")
+            return False
+        if isinstance(node, exp.Func) and node.name.lower() in DENY_FUNCTIONS:
+            print(f"Validation Failed: Query calls forbidden function '{node.name}'.")
             return False
 
-    if query_lower.count("join") > MAX_JOINS:
+    join_count = len(list(statement.find_all(exp.Join)))
+    if join_count > MAX_JOINS:
         print(f"Validation Failed: Query exceeds the maximum of {MAX_JOINS} JOINs.")
         return False
 
     return True
 
-def sanitize_and_limit_query(sql_query: str) -> str:
+def _limit_value(limit):
+    """Returns the integer row count of a LIMIT/FETCH clause, or None if it isn't a literal."""
+    count = limit.args.get("count") if isinstance(limit, exp.Fetch) else limit.expression
+    if isinstance(count, exp.Literal) and not count.is_string and count.this.isdigit():
+        return int(count.this)
+    return None
+
+def _expand_stars(statement, table_columns: dict):
+    """
+    Replaces `*` and `alias.*` with the explicit non-vector columns of the
+    referenced tables, so embedding vectors are never fetched. A star is left
+    alone when its sources can't be resolved (subqueries, CTEs, USING/NATURAL
+    joins) or when none of them has a vector column.
+    """
+    cte_names = {cte.alias_or_name for cte in statement.find_all(exp.CTE)}
+
+    for select in list(statement.find_all(exp.Select)):
+        from_ = select.args.get("from") or select.args.get("from_")
+        if from_ is None:
+            continue
+        joins = select.args.get("joins") or []
+        sources = [from_.this] + [join.this for join in joins]
+        if any(join.args.get("using") or join.args.get("kind") == "NATURAL" for join in joins):
+            continue
+
+        # alias -> columns for every source that is a known base table
+        resolved = {}
+        unresolved = False
+        for source in sources:
+            if isinstance(source, exp.Table) and source.name not in cte_names and source.name in table_columns:
+                resolved[source.alias_or_name] = table_columns[source.name]
+            else:
+                unresolved = True
+
+        def columns_for(alias):
+            return [exp.column(name, table=alias) for name, is_vector in resolved[alias] if not is_vector]
+
+        def has_vectors(alias):
+            return any(is_vector for _, is_vector in resolved[alias])
+
+        projections = []
+        changed = False
+        for projection in select.expressions:
+            if isinstance(projection, exp.Star) and not unresolved and any(has_vectors(alias) for alias in resolved):
+                for alias in resolved:
+                    projections.extend(columns_for(alias))
+                changed = True
+            elif (
+                isinstance(projection, exp.Column)
+                and isinstance(projection.this, exp.Star)
+                and projection.table in resolved
+                and has_vectors(projection.table)
+            ):
+                projections.extend(columns_for(projection.table))
+                changed = True
+            else:
+                projections.append(projection)
+
+        if changed:
+            print("Sanitization: Expanded '*' to exclude vector columns.")
+            select.set("expressions", projections)
+    return statement
+
+def sanitize_and_limit_query(sql_query: str, table_columns: dict = None) -> str:
+    """
+    Sanitizes the query and ensures the outermost query has a LIMIT clause,
+    clamping an existing one to MAX_LIMIT. When `table_columns` is given
+    ({table: [(column, is_vector), ...]}), star projections are expanded so
+    vector columns are not selected.
+    """
+    statement = _parse_single(sql_query).copy()
+
+    if table_columns:
+        statement = _expand_stars(statement, table_columns)
+
+    limit = statement.args.get("limit")
+    current = _limit_value(limit) if limit is not None else None
+    if limit is None:
+        print(f"Sanitization: No outer LIMIT clause found. Appending 'LIMIT {DEFAULT_LIMIT}'.")
+        new_limit = DEFAULT_LIMIT
+    elif current is None:
+        print(f"Sanitization: Outer LIMIT is not a constant. Replacing it with 'LIMIT {DEFAULT_LIMIT}'.")
+        new_limit = DEFAULT_LIMIT
+    elif current > MAX_LIMIT:
+        print(f"Sanitization: Clamping 'LIMIT {current}' to 'LIMIT {MAX_LIMIT}'.")
+        new_limit = MAX_LIMIT
+    else:
+        new_limit = None
+
+    if new_limit is not None:
+        statement.set("limit", exp.Limit(expression=exp.Literal.number(new_limit)))
+
+    return statement.sql(dialect=DIALECT) + ";"
+
+def _complete_words(partial_sql: str):
+    """
+    Yields (word, is_complete) for words outside string literals, quoted
+    identifiers and comments, and reports whether a statement terminator was
+    seen. A word touching the end of the text may still grow, so it is
+    reported as incomplete.
+    """
+    words = []
+    terminated = False
+    i, length = 0, len(partial_sql)
+    while i < length:
+        char = partial_sql[i]
+        if char in ("'", '"'):
+            end = partial_sql.find(char, i + 1)
+            if end == -1:
+                break
+            i = end + 1
+        elif partial_sql.startswith("--", i):
+            end = partial_sql.find("\n", i)
+            if end == -1:
+                break
+            i = end + 1
+        elif partial_sql.startswith("/*", i):
+            end = partial_sql.find("*/", i + 2)
+            if end == -1:
+                break
+            i = end + 2
+        elif char == ";":
+            terminated = True
+            break
+        elif char.isalpha() or char == "_":
+            start = i
+            while i < length and (partial_sql[i].isalnum() or partial_sql[i] == "_"):
+                i += 1
+            words.append((partial_sql[start:i].lower(), i < length))
+        else:
+            i += 1
+    return words, terminated
+
+# Where the statement starts when the model writes prose before it: a code
+# fence, or a line beginning with a statement keyword. Forbidden keywords count
+# too, so a bare "DROP ..." is still rejected by its first word.
+_STATEMENT_START = re.compile(
+    r"```|^[ \t]*(?:select|with|" + "|".join(DENY_LIST) + r")(?=\W)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def _skip_preamble(partial_sql: str):
+    """Returns the text from the start of the statement, or None while it hasn't arrived yet."""
+    match = _STATEMENT_START.search(partial_sql)
+    return partial_sql[match.start():].lstrip() if match else None
+
+def check_partial_query(partial_sql: str) -> str:
     """
-    Sanitizes the query and ensures a LIMIT clause is present.
+    Incrementally validates SQL while it is still being generated.
+    Returns "unsafe" as soon as a forbidden construct appears, "complete" once
+    the statement has been closed (by ';' or the end of a markdown code block),
+    and "incomplete" otherwise.
     """
-    query = sql_query.strip()
+    text = _skip_preamble(partial_sql)
+    if text is None:
+        return "incomplete"
+    if text.startswith("```"):
+        text = text[3:]
+        if text.lower().startswith("sql"):
+            text = text[3:]
+    closed = "```" in text
+    if closed:
+        text = text[:text.index("```")]
 
-    if query.endswith(';'):
-        query = query[:-1]
+    words, terminated = _complete_words(text)
+    complete_words = [word for word, is_complete in words if is_complete or terminated or closed]
 
-    if "limit" not in query.lower():
-        query = f"{query} LIMIT {DEFAULT_LIMIT}"
-        print(f"Sanitization: No LIMIT clause found. Appending 'LIMIT {DEFAULT_LIMIT}'.")
+    if complete_words and complete_words[0] not in ("select", "with"):
+        print(f"Streaming validation failed: query starts with '{complete_words[0]}'.")
+        return "unsafe"
+    for word in complete_words:
+        if word in DENY_LIST:
+            print(f"Streaming validation failed: query contains forbidden keyword '{word}'.")
+            return "unsafe"
+    if complete_words.count("join") > MAX_JOINS:
+        print(f"Streaming validation failed: query exceeds the maximum of {MAX_JOINS} JOINs.")
+        return "unsafe"
 
-    return query + ";"
\ No newline at end of file
+    if terminated or closed:
+        return "complete"
+    return "incomplete"
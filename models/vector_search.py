@@ -1,46 +1,243 @@
+import json
+import numpy as np
 from sqlalchemy import text
-from config import database
-from sentence_transformers import SentenceTransformer
+from config import database, settings
+from utils import embedding_provider, tracing
 
-# Load the same model we used for generating embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# The HNSW operator class and the ORDER BY operator must match, otherwise
+# pgvector cannot use the index and falls back to a sequential scan + sort.
+# Both the index DDL and the lookup queries are generated from this table.
+VECTOR_METRICS = {
+    "cosine": {"opclass": "vector_cosine_ops", "operator": "<=>"},
+    "l2": {"opclass": "vector_l2_ops", "operator": "<->"},
+    "inner_product": {"opclass": "vector_ip_ops", "operator": "<#>"},
+}
+
+if settings.VECTOR_METRIC not in VECTOR_METRICS:
+    raise ValueError(f"Unknown VECTOR_METRIC '{settings.VECTOR_METRIC}'. Choose from {list(VECTOR_METRICS)}.")
+
+METRIC = VECTOR_METRICS[settings.VECTOR_METRIC]
+
+if settings.VECTOR_SEARCH_BACKEND not in ("postgres", "local"):
+    raise ValueError(f"Unknown VECTOR_SEARCH_BACKEND '{settings.VECTOR_SEARCH_BACKEND}'. Choose from ['postgres', 'local'].")
+
+# The searchable entity columns and the HNSW index that serves each of them.
+ENTITY_LOOKUPS = {
+    "product": {
+        "table": "products",
+        "id_column": "id",
+        "name_column": "name",
+        "embedding_column": "name_embedding",
+        "index": "idx_products_name_embedding",
+    },
+    "employee": {
+        "table": "employees",
+        "id_column": "id",
+        "name_column": "name",
+        "embedding_column": "name_embedding",
+        "index": "idx_employees_name_embedding",
+    },
+    # Distinct customer names (sql/customer_names.sql), so each customer is one candidate.
+    "customer": {
+        "table": "customer_names",
+        "id_column": "id",
+        "name_column": "name",
+        "embedding_column": "name_embedding",
+        "index": "idx_customer_names_name_embedding",
+    },
+}
+
+def _index_ddl(lookup: dict) -> str:
+    return (
+        f"CREATE INDEX IF NOT EXISTS {lookup['index']} ON {lookup['table']} "
+        f"USING hnsw ({lookup['embedding_column']} {METRIC['opclass']});"
+    )
+
+def get_index_ddl():
+    """Returns the CREATE INDEX statements for every lookup, using the configured metric."""
+    return [_index_ddl(lookup) for lookup in ENTITY_LOOKUPS.values()]
+
+def _statement_name(entity: str) -> str:
+    return f"find_similar_{entity}_{settings.VECTOR_METRIC}"
+
+def _prepare_lookup(connection, entity: str) -> str:
+    """
+    Prepares the lookup as a server-side statement once per pooled connection, so
+    Postgres parses and plans it once instead of on every question.
+    """
+    name = _statement_name(entity)
+    prepared = connection.info.setdefault("prepared_lookups", set())
+    if name not in prepared:
+        lookup = ENTITY_LOOKUPS[entity]
+        connection.exec_driver_sql(
+            f"PREPARE {name} (vector, integer) AS "
+            f"SELECT {lookup['id_column']}, {lookup['name_column']} FROM {lookup['table']} "
+            f"ORDER BY {lookup['embedding_column']} {METRIC['operator']} $1 LIMIT $2"
+        )
+        prepared.add(name)
+    return name
+
+def _set_ef_search(connection, ef_search: int = None):
+    # SET LOCAL scopes ef_search to this transaction so pooled connections stay clean.
+    connection.exec_driver_sql(f"SET LOCAL hnsw.ef_search = {int(ef_search or settings.HNSW_EF_SEARCH)}")
+
+def _find_similar(entity: str, query: str, top_k: int, ef_search: int = None):
+    # The embedding is bound as a query parameter through the pgvector adapter
+    # registered in config.database, which psycopg2 sends as a text vector
+    # literal ('[0.1,0.2,...]'); it is never formatted into the SQL text itself.
+    query_embedding = embedding_provider.encode(query)
+
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        from models import local_vector_index
+        rows = local_vector_index.lookup_rows({entity: [query_embedding]}, top_k)
+        return [(item_id, name) for _, _, item_id, name, _ in rows]
 
-def find_similar_products(query: str, top_k: int = 1):
-    """Finds the most similar products to a given query using vector search."""
-    query_embedding = model.encode(query).tolist()
-    # Manually format the vector into the string representation PostgreSQL expects: '[1.2, 3.4, ...]'
-    embedding_str = str(query_embedding)
-    
     engine = database.get_db_engine()
-    with engine.connect() as connection:
-        # Construct the SQL with the vector string directly inside.
-        # Use a safe, named parameter for the simple integer limit.
-        sql_query = text(f"SELECT id, name FROM products ORDER BY name_embedding <=> '{embedding_str}'::vector LIMIT :limit")
-        
-        result = connection.execute(sql_query, {"limit": top_k})
+    with engine.begin() as connection:
+        _set_ef_search(connection, ef_search)
+        name = _prepare_lookup(connection, entity)
+        result = connection.exec_driver_sql(
+            f"EXECUTE {name}(%(embedding)s, %(limit)s)",
+            {"embedding": query_embedding, "limit": top_k},
+        )
         return result.fetchall()
 
-def find_similar_employees(query: str, top_k: int = 1):
+def find_similar_products(query: str, top_k: int = 1, ef_search: int = None):
+    """Finds the most similar products to a given query using vector search."""
+    return _find_similar("product", query, top_k, ef_search)
+
+def find_similar_employees(query: str, top_k: int = 1, ef_search: int = None):
     """Finds the most similar employees to a given query."""
-    query_embedding = model.encode(query).tolist()
-    embedding_str = str(query_embedding)
-    
+    return _find_similar("employee", query, top_k, ef_search)
+
+def find_similar_customers(query: str, top_k: int = 1, ef_search: int = None):
+    """Finds the most similar distinct customer names to a given query."""
+    return _find_similar("customer", query, top_k, ef_search)
+
+def _batched_lookup_sql(entity: str, embeddings_param: str, top_k_param: str) -> str:
+    lookup = ENTITY_LOOKUPS[entity]
+    # One lateral k-NN subquery per query vector; ORDER BY ... LIMIT inside the
+    # lateral lets each probe use the HNSW index.
+    return (
+        f"SELECT '{entity}' AS entity, q.ord, m.id, m.name, m.distance "
+        f"FROM unnest({embeddings_param}::vector[]) WITH ORDINALITY AS q(embedding, ord) "
+        f"CROSS JOIN LATERAL ("
+        f"SELECT {lookup['id_column']} AS id, {lookup['name_column']} AS name, "
+        f"{lookup['embedding_column']} {METRIC['operator']} q.embedding AS distance "
+        f"FROM {lookup['table']} ORDER BY distance LIMIT {top_k_param}"
+        f") AS m"
+    )
+
+def build_entity_lookup_sql(entity_types, placeholder):
+    """
+    Builds the single-round-trip lookup for the given entity types.
+    `placeholder` maps a parameter name ("<entity>_embeddings" or "top_k") to the
+    driver's placeholder syntax, so the sync and async drivers share this SQL.
+    """
+    parts = [
+        f"({_batched_lookup_sql(entity, placeholder(f'{entity}_embeddings'), placeholder('top_k'))})"
+        for entity in entity_types
+    ]
+    return " UNION ALL ".join(parts) + " ORDER BY entity, ord, distance"
+
+def entity_terms(entities: dict):
+    """Flattens {entity_type: [terms]} into an ordered list of (entity_type, term)."""
+    return [(entity, term) for entity in ENTITY_LOOKUPS for term in entities.get(entity, [])]
+
+def group_embeddings(terms, embeddings):
+    """Groups the batch embeddings by entity type, preserving term order."""
+    grouped = {}
+    for (entity, _), embedding in zip(terms, embeddings):
+        grouped.setdefault(entity, []).append(np.asarray(embedding, dtype=np.float32))
+    return grouped
+
+def collect_entity_results(terms, rows):
+    """Shapes (entity, ord, id, name, distance) rows into per-term candidate lists."""
+    results = {}
+    for entity, term in terms:
+        results.setdefault(entity, []).append({"term": term, "candidates": []})
+    for entity, ord_, item_id, name, distance in rows:
+        results[entity][ord_ - 1]["candidates"].append((item_id, name, float(distance)))
+    return results
+
+def find_similar_entities(entities: dict, top_k: int = 3, ef_search: int = None):
+    """
+    Resolves several fuzzy entities at once. `entities` maps an entity type
+    ("product", "employee", "customer") to a list of search terms. All terms are
+    encoded in one batch and looked up in a single round trip, or in the local
+    in-process index when VECTOR_SEARCH_BACKEND is "local".
+
+    Returns {entity_type: [{"term": str, "candidates": [(id, name, distance), ...]}, ...]}
+    with candidates ordered from closest to furthest.
+    """
+    terms = entity_terms(entities)
+    if not terms:
+        return {}
+
+    with tracing.span("embedding", terms=len(terms)):
+        grouped = group_embeddings(terms, embedding_provider.encode([term for _, term in terms]))
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        from models import local_vector_index
+        with tracing.span("vector_search", backend="local"):
+            return collect_entity_results(terms, local_vector_index.lookup_rows(grouped, top_k))
+
+    params = {f"{entity}_embeddings": embeddings for entity, embeddings in grouped.items()}
+    params["top_k"] = top_k
+    sql_query = build_entity_lookup_sql(grouped, lambda name: f"%({name})s")
+
     engine = database.get_db_engine()
-    with engine.connect() as connection:
-        sql_query = text(f"SELECT id, name FROM employees ORDER BY name_embedding <=> '{embedding_str}'::vector LIMIT :limit")
-        
-        result = connection.execute(sql_query, {"limit": top_k})
-        return result.fetchall()
+    with tracing.span("vector_search", backend="postgres"), engine.begin() as connection:
+        _set_ef_search(connection, ef_search)
+        rows = connection.exec_driver_sql(sql_query, params).fetchall()
+
+    return collect_entity_results(terms, rows)
 
-def find_similar_customers(query: str, top_k: int = 1):
-    """Finds the most similar customer names from orders to a given query."""
-    query_embedding = model.encode(query).tolist()
-    embedding_str = str(query_embedding)
-    
+def _plan_uses_index(plan: dict, index_name: str) -> bool:
+    if plan.get("Index Name") == index_name and "Index" in plan.get("Node Type", ""):
+        return True
+    return any(_plan_uses_index(child, index_name) for child in plan.get("Plans", []))
+
+def check_index_usage():
+    """
+    Runs EXPLAIN on each lookup and warns when the planner does not use the
+    HNSW index, e.g. because the index was built with a different operator class.
+    Returns a dict of entity -> True/False (None if the check could not run).
+    """
+    probe = np.zeros(384, dtype=np.float32)
+    probe[-1] = 1.0
+    report = {}
     engine = database.get_db_engine()
-    with engine.connect() as connection:
-        sql_query = text(f"SELECT id, customer_name FROM orders ORDER BY customer_name_embedding <=> '{embedding_str}'::vector LIMIT :limit")
-        
-        result = connection.execute(sql_query, {"limit": top_k})
-        return result.fetchall()
+    for entity, lookup in ENTITY_LOOKUPS.items():
+        try:
+            with engine.begin() as connection:
+                indexdef = connection.execute(
+                    text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"),
+                    {"name": lookup["index"]},
+                ).scalar()
+                if indexdef is None:
+                    print(f"Vector index check: index '{lookup['index']}' on {lookup['table']} does not exist.")
+                elif METRIC["opclass"] not in indexdef:
+                    print(
+                        f"Vector index check: '{lookup['index']}' is not built with {METRIC['opclass']} "
+                        f"(found: {indexdef}). Drop it and recreate it with: {_index_ddl(lookup)}"
+                    )
+
+                _set_ef_search(connection)
+                name = _prepare_lookup(connection, entity)
+                raw_plan = connection.exec_driver_sql(
+                    f"EXPLAIN (FORMAT JSON) EXECUTE {name}(%(embedding)s, 1)", {"embedding": probe}
+                ).scalar()
+            plan = raw_plan if isinstance(raw_plan, list) else json.loads(raw_plan)
+            uses_index = _plan_uses_index(plan[0]["Plan"], lookup["index"])
+            if not uses_index:
+                print(f"Vector index check: {entity} lookup on {lookup['table']} is NOT using an index scan.")
+            report[entity] = uses_index
+        except Exception as e:
+            print(f"Vector index check for {entity} failed: {e}")
+            report[entity] = None
+    return report
 
+if __name__ == "__main__":
+    for statement in get_index_ddl():
+        print(statement)
+    print(check_index_usage())
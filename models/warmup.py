@@ -0,0 +1,70 @@
+import threading
+from config import database, settings
+from utils import embedding_provider, startup_timing
+
+_started = False
+_done = threading.Event()
+_lock = threading.Lock()
+
+def _warm_up():
+    # Each step is independent: a failure (e.g. database not reachable yet) is
+    # logged and the remaining steps still run.
+    steps = [
+        ("import_openai", lambda: __import__("openai")),
+        ("import_pandas", lambda: __import__("pandas")),
+        ("embedding_model", embedding_provider.warm_up),
+        ("db_pool", _warm_db_pool),
+        ("schema_catalog", _warm_schema),
+        ("entity_gazetteer", _warm_gazetteer),
+    ]
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        steps.append(("local_vector_index", _warm_local_index))
+    elif settings.VECTOR_INDEX_CHECK_ON_STARTUP:
+        steps.append(("vector_index_check", _check_vector_indexes))
+
+    for name, step in steps:
+        try:
+            with startup_timing.phase(name):
+                step()
+        except Exception as e:
+            print(f"Warm-up step '{name}' failed: {e}")
+    startup_timing.uninstall()
+    _done.set()
+    print(f"Warm-up finished: {startup_timing.get_report()['phases_ms']}")
+
+def _warm_db_pool():
+    engine = database.get_db_engine()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+
+def _warm_schema():
+    from models import schema_provider
+    schema_provider.get_table_columns()
+
+def _warm_gazetteer():
+    from models import entity_gazetteer
+    entity_gazetteer.analyze("warm up")
+
+def _check_vector_indexes():
+    from models import vector_search
+    vector_search.check_index_usage()
+
+def _warm_local_index():
+    from models import local_vector_index
+    local_vector_index.warm_up()
+
+def start_background_warmup():
+    """
+    Loads the heavy subsystems (OpenAI client, embedding model, connection
+    pool, schema and gazetteer) on a daemon thread, once per process. Call it
+    after the page has rendered so the first paint isn't blocked.
+    """
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+def is_warm():
+    return _done.is_set()
@@ -6,10 +6,13 @@ ADD COLUMN name_embedding VECTOR(384);
 ALTER TABLE products
 ADD COLUMN name_embedding VECTOR(384);
 
-ALTER TABLE orders
-ADD COLUMN customer_name_embedding VECTOR(384);
+-- Customer names are embedded once per distinct name in the customer_names
+-- vocabulary (sql/customer_names.sql), not on every order row.
 
--- Optional: Create indexes on these new columns for much faster searching later
-CREATE INDEX idx_employees_name_embedding ON employees USING hnsw (name_embedding vector_l2_ops);
-CREATE INDEX idx_products_name_embedding ON products USING hnsw (name_embedding vector_l2_ops);
-CREATE INDEX idx_orders_customer_name_embedding ON orders USING hnsw (customer_name_embedding vector_l2_ops);
\ No newline at end of file
+-- Create HNSW indexes on these new columns for fast similarity search.
+-- The operator class must match the distance operator used by the lookups in
+-- models/vector_search.py (VECTOR_METRICS / VECTOR_METRIC, default cosine: <=>),
+-- otherwise the planner cannot use the index. Run `python -m models.vector_search`
+-- to print the statements for the configured metric and check index usage.
+CREATE INDEX idx_employees_name_embedding ON employees USING hnsw (name_embedding vector_cosine_ops);
+CREATE INDEX idx_products_name_embedding ON products USING hnsw (name_embedding vector_cosine_ops);
@@ -0,0 +1,103 @@
+-- Distinct customer-name vocabulary for vector search.
+-- Orders repeat the customer name on every row. Storing (and indexing) one
+-- embedding per distinct name instead of per order keeps the HNSW index and the
+-- embedding backfill proportional to the number of customers, and lookups return
+-- distinct candidates. Run after add_embeddings.sql; safe to re-run.
+
+CREATE TABLE IF NOT EXISTS customer_names (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) UNIQUE NOT NULL,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    name_embedding VECTOR(384)
+);
+
+-- Same operator class as the other lookups (see add_embeddings.sql).
+CREATE INDEX IF NOT EXISTS idx_customer_names_name_embedding ON customer_names USING hnsw (name_embedding vector_cosine_ops);
+
+-- Keeps the vocabulary in step with orders: new names are added, order counts are
+-- maintained, and names without orders are removed. The triggers are per statement
+-- and read the changed rows from transition tables, so a statement touches each
+-- affected name's counter once, however many orders it inserts, and bulk loads
+-- don't pay an extra UPDATE per row.
+
+-- Applies per-name changes in order count (names and deltas are parallel arrays).
+CREATE OR REPLACE FUNCTION apply_customer_name_deltas(names TEXT[], deltas BIGINT[]) RETURNS void AS $$
+BEGIN
+    UPDATE customer_names c SET order_count = c.order_count + d.delta
+    FROM unnest(names, deltas) AS d(name, delta)
+    WHERE c.name = d.name;
+    -- Update first: an INSERT ... ON CONFLICT would fire the embedding-queue
+    -- trigger on customer_names for every existing customer.
+    INSERT INTO customer_names (name, order_count)
+    SELECT d.name, d.delta FROM unnest(names, deltas) AS d(name, delta)
+    WHERE d.delta > 0 AND NOT EXISTS (SELECT 1 FROM customer_names c WHERE c.name = d.name)
+    ON CONFLICT (name) DO UPDATE SET order_count = customer_names.order_count + EXCLUDED.order_count;
+    DELETE FROM customer_names c USING unnest(names) AS d(name)
+    WHERE c.name = d.name AND c.order_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_customer_names() RETURNS trigger AS $$
+DECLARE
+    names TEXT[];
+    deltas BIGINT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(customer_name), array_agg(n) INTO names, deltas
+        FROM (SELECT customer_name, count(*) AS n FROM new_orders GROUP BY customer_name) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(customer_name), array_agg(-n) INTO names, deltas
+        FROM (SELECT customer_name, count(*) AS n FROM old_orders GROUP BY customer_name) d;
+    ELSE
+        -- Only orders whose name actually changed; rewriting the same name (or
+        -- updating other columns) leaves the vocabulary and its embeddings alone.
+        SELECT array_agg(name), array_agg(delta) INTO names, deltas
+        FROM (
+            SELECT name, sum(delta) AS delta
+            FROM (
+                SELECT n.customer_name AS name, 1 AS delta
+                FROM old_orders o JOIN new_orders n ON n.id = o.id
+                WHERE o.customer_name IS DISTINCT FROM n.customer_name
+                UNION ALL
+                SELECT o.customer_name, -1
+                FROM old_orders o JOIN new_orders n ON n.id = o.id
+                WHERE o.customer_name IS DISTINCT FROM n.customer_name
+            ) changes
+            GROUP BY name
+        ) d;
+    END IF;
+    IF names IS NOT NULL THEN
+        PERFORM apply_customer_name_deltas(names, deltas);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow one event per trigger and no column list.
+DROP TRIGGER IF EXISTS orders_sync_customer_names ON orders;
+DROP TRIGGER IF EXISTS orders_sync_customer_names_insert ON orders;
+CREATE TRIGGER orders_sync_customer_names_insert
+    AFTER INSERT ON orders REFERENCING NEW TABLE AS new_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_customer_names();
+
+DROP TRIGGER IF EXISTS orders_sync_customer_names_update ON orders;
+CREATE TRIGGER orders_sync_customer_names_update
+    AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_customer_names();
+
+DROP TRIGGER IF EXISTS orders_sync_customer_names_delete ON orders;
+CREATE TRIGGER orders_sync_customer_names_delete
+    AFTER DELETE ON orders REFERENCING OLD TABLE AS old_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_customer_names();
+
+-- Backfill (or re-sync) from the orders already in the table.
+INSERT INTO customer_names (name, order_count)
+SELECT customer_name, count(*) FROM orders GROUP BY customer_name
+ON CONFLICT (name) DO UPDATE SET order_count = EXCLUDED.order_count;
+
+DELETE FROM customer_names c WHERE NOT EXISTS (SELECT 1 FROM orders o WHERE o.customer_name = c.name);
+
+-- Databases set up before the vocabulary existed stored one embedding per order.
+DROP TRIGGER IF EXISTS orders_enqueue_embedding ON orders;
+DROP INDEX IF EXISTS idx_orders_customer_name_embedding;
+ALTER TABLE orders DROP COLUMN IF EXISTS customer_name_embedding;
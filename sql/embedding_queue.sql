@@ -0,0 +1,48 @@
+-- Change-driven embedding maintenance.
+-- Inserted rows and rows whose name changes are queued here by triggers, and
+-- utils/embedding_worker.py embeds them within seconds. Run after add_embeddings.sql
+-- and customer_names.sql.
+
+CREATE TABLE IF NOT EXISTS embedding_queue (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Trigger arguments: the text column and the embedding column of the table.
+CREATE OR REPLACE FUNCTION enqueue_embedding() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF (to_jsonb(NEW) ->> TG_ARGV[0]) IS NOT DISTINCT FROM (to_jsonb(OLD) ->> TG_ARGV[0]) THEN
+            RETURN NEW;
+        END IF;
+        -- The old embedding describes the old name, so clear it until it is recomputed.
+        NEW := jsonb_populate_record(NEW, jsonb_build_object(TG_ARGV[1], NULL));
+    ELSIF (to_jsonb(NEW) ->> TG_ARGV[1]) IS NOT NULL THEN
+        -- Inserted with an embedding already computed.
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO embedding_queue (table_name, row_id) VALUES (TG_TABLE_NAME, NEW.id);
+    -- Notifications are de-duplicated per transaction, so bulk loads send one per table.
+    PERFORM pg_notify('embedding_queue', TG_TABLE_NAME);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_enqueue_embedding ON products;
+CREATE TRIGGER products_enqueue_embedding
+    BEFORE INSERT OR UPDATE OF name ON products
+    FOR EACH ROW EXECUTE FUNCTION enqueue_embedding('name', 'name_embedding');
+
+DROP TRIGGER IF EXISTS employees_enqueue_embedding ON employees;
+CREATE TRIGGER employees_enqueue_embedding
+    BEFORE INSERT OR UPDATE OF name ON employees
+    FOR EACH ROW EXECUTE FUNCTION enqueue_embedding('name', 'name_embedding');
+
+-- Customer names are embedded once per distinct name, in the vocabulary table.
+DROP TRIGGER IF EXISTS customer_names_enqueue_embedding ON customer_names;
+CREATE TRIGGER customer_names_enqueue_embedding
+    BEFORE INSERT OR UPDATE OF name ON customer_names
+    FOR EACH ROW EXECUTE FUNCTION enqueue_embedding('name', 'name_embedding');
@@ -0,0 +1,21 @@
+import pytest
+from models import sql_validator
+
+PREAMBLE = "Sure! Here is the query that lists the newest orders:\n\n"
+
+def test_partial_query_with_prose_preamble_is_not_rejected():
+    response = PREAMBLE + "```sql\nSELECT id, order_date FROM orders ORDER BY order_date DESC"
+    assert sql_validator.check_partial_query(PREAMBLE) == "incomplete"
+    assert sql_validator.check_partial_query(response) == "incomplete"
+    assert sql_validator.check_partial_query(response + ";\n```") == "complete"
+
+def test_partial_query_with_prose_preamble_and_no_fence():
+    helpers = pytest.importorskip("utils.helpers")
+    response = PREAMBLE + "SELECT id FROM orders;"
+    assert sql_validator.check_partial_query(response) == "complete"
+    assert helpers.extract_sql_from_response(response) == "SELECT id FROM orders;"
+
+def test_partial_query_after_preamble_is_still_validated():
+    assert sql_validator.check_partial_query(PREAMBLE + "```sql\nDROP TABLE orders") == "unsafe"
+    assert sql_validator.check_partial_query(PREAMBLE + "SELECT 1; DELETE FROM orders") == "complete"
+    assert sql_validator.check_partial_query("DELETE FROM orders") == "unsafe"
@@ -0,0 +1,214 @@
+import decimal
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from config import settings
+
+# Picks a chart for a query result from its column types and cardinality, and
+# reduces large results to what a browser chart can draw: LTTB for line series,
+# per-category sums (top categories plus "Other") for bars, a fixed-seed
+# sample for scatter plots.
+#
+# Recommendations and the prepared chart data are memoized per result-set
+# fingerprint, so toggling "Build Chart" on the same result costs nothing.
+
+CHART_TYPES = ("bar", "line", "scatter")
+MAX_Y_COLUMNS = 3
+MAX_MEMOIZED = 64
+
+_ID_COLUMN = re.compile(r"(^|_)id$", re.IGNORECASE)
+_memo = OrderedDict()
+_lock = threading.Lock()
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """Hashes the frame's columns, dtypes and values."""
+    digest = hashlib.sha256(repr([(str(name), str(dtype)) for name, dtype in df.dtypes.items()]).encode("utf-8"))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        # Unhashable cells (lists, dicts): fall back to their text.
+        digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _first_value(series: pd.Series):
+    non_null = series.dropna()
+    return non_null.iloc[0] if len(non_null) else None
+
+def normalize_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts columns Arrow hands to pandas as Python objects: NUMERIC (Decimal)
+    to float and DATE to datetime64.
+    """
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype != object:
+            continue
+        value = _first_value(series)
+        if isinstance(value, decimal.Decimal):
+            converted[column] = pd.to_numeric(series, errors="coerce").astype(float)
+        elif hasattr(value, "isoformat") and hasattr(value, "year"):
+            converted[column] = pd.to_datetime(series, errors="coerce")
+    return df.assign(**converted) if converted else df
+
+def _classify(df: pd.DataFrame):
+    dates, measures, categories = [], [], []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            dates.append(column)
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            # Keys are numbers but not measures; they can still label bars.
+            (categories if _ID_COLUMN.search(str(column)) else measures).append(column)
+        else:
+            categories.append(column)
+    return dates, measures, categories
+
+def recommend(df: pd.DataFrame):
+    """
+    Returns {"chart_type", "x_column", "y_column", "title"} from the column
+    types, or None when no rule applies:
+
+    - a date column and a numeric column -> line
+    - a categorical column and a numeric column -> bar
+    - two numeric columns -> scatter
+    """
+    if len(df) < 2:
+        return None
+    dates, measures, categories = _classify(df)
+    if not measures:
+        return None
+    y_columns = measures[:MAX_Y_COLUMNS]
+
+    if dates:
+        x_column = dates[0]
+        return _recommendation("line", x_column, y_columns, f"{', '.join(map(str, y_columns))} over {x_column}")
+    if categories:
+        # Labels read better than keys, and fewer distinct values read best as bars.
+        x_column = min(categories, key=lambda column: (bool(_ID_COLUMN.search(str(column))), df[column].nunique(dropna=True)))
+        if df[x_column].nunique(dropna=True) > 1:
+            return _recommendation("bar", x_column, y_columns[:1], f"{y_columns[0]} by {x_column}")
+    if len(measures) >= 2:
+        return _recommendation("scatter", measures[0], measures[1], f"{measures[1]} vs {measures[0]}")
+    return None
+
+def _recommendation(chart_type, x_column, y_column, title):
+    return {"chart_type": chart_type, "x_column": x_column, "y_column": y_column, "title": title}
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: returns the indices of `threshold` points
+    that keep the visual shape of the series (peaks, dips, trend). `x` must be
+    sorted. Each bucket is scored with one vectorized operation.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # threshold - 2 buckets over the points between the first and the last.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket == threshold - 3:
+            cx, cy = x[n - 1], y[n - 1]
+        else:
+            next_end = edges[bucket + 2]
+            cx, cy = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        selected[bucket + 1] = a
+    return selected
+
+def _downsample_line(df, x_column, y_columns, max_points):
+    df = df.dropna(subset=[x_column]).sort_values(x_column, kind="stable")
+    if len(df) <= max_points:
+        return df
+    x = df[x_column].to_numpy()
+    x = x.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x.astype(float)
+    keep = set()
+    # Each series keeps its own peaks; the union stays within len(y_columns) * max_points.
+    for column in y_columns:
+        y = df[column].to_numpy(dtype=float, na_value=np.nan)
+        valid = np.flatnonzero(~np.isnan(y))
+        keep.update(valid[lttb_indices(x[valid], y[valid], max_points // len(y_columns))])
+    return df.iloc[sorted(keep)]
+
+def _aggregate_bars(df, x_column, y_columns, max_categories):
+    # Sums per category, so every bar reflects all of its rows.
+    totals = df.groupby(x_column, dropna=False, sort=False)[y_columns].sum()
+    if len(totals) > max_categories:
+        top = totals.nlargest(max_categories - 1, y_columns[0])
+        other = totals.drop(top.index).sum().to_frame("Other").T
+        totals = pd.concat([top.rename(index=str), other])
+    return totals.rename_axis(x_column).reset_index()
+
+def prepare(df: pd.DataFrame, recommendation: dict, max_points: int = None, max_categories: int = None):
+    """
+    Returns the frame to hand to the chart: only the charted columns, reduced
+    to about `max_points` points (CHART_MAX_POINTS) or `max_categories` bars.
+    """
+    max_points = max_points or settings.CHART_MAX_POINTS
+    max_categories = max_categories or settings.CHART_MAX_CATEGORIES
+    chart_type = recommendation["chart_type"]
+    x_column = recommendation["x_column"]
+    y_columns = recommendation["y_column"]
+    y_columns = [y_columns] if isinstance(y_columns, str) else list(y_columns)
+    df = df[[x_column] + [column for column in y_columns if column != x_column]]
+
+    if chart_type == "line":
+        return _downsample_line(df, x_column, y_columns, max_points)
+    if chart_type == "bar":
+        return _aggregate_bars(df, x_column, y_columns, max_categories)
+    # Scatter plots show individual points, so a sample keeps their shape.
+    if len(df) > max_points:
+        return df.sample(n=max_points, random_state=0).sort_index()
+    return df
+
+def get_chart(df: pd.DataFrame, question: str, llm_fallback=None, result_id: str = None):
+    """
+    Returns (recommendation, chart_frame, source) for a result, where source is
+    "rules", "llm" or "cache". `llm_fallback(df, question)` is asked only when
+    no rule applies. Returns a None recommendation when no chart fits.
+
+    `result_id` identifies the result when the caller already has a unique id
+    for it; otherwise the frame is fingerprinted.
+    """
+    key = (result_id or fingerprint(df), question)
+    with _lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            recommendation, chart_frame, _ = _memo[key]
+            return recommendation, chart_frame, "cache"
+
+    df = normalize_types(df)
+    recommendation, source = recommend(df), "rules"
+    if recommendation is None and llm_fallback is not None:
+        recommendation, source = _validate(df, llm_fallback(df, question)), "llm"
+    chart_frame = prepare(df, recommendation) if recommendation else None
+
+    with _lock:
+        _memo[key] = (recommendation, chart_frame, source)
+        while len(_memo) > MAX_MEMOIZED:
+            _memo.popitem(last=False)
+    return recommendation, chart_frame, source
+
+def _validate(df, recommendation):
+    """Accepts an LLM recommendation only if it names existing columns and numeric y columns."""
+    if not recommendation or recommendation.get("chart_type") in (None, "none"):
+        return None
+    y_columns = recommendation.get("y_column")
+    y_columns = [y_columns] if isinstance(y_columns, str) else list(y_columns or [])
+    columns = set(df.columns)
+    if recommendation.get("x_column") not in columns or not y_columns or not set(y_columns) <= columns:
+        return None
+    # Bars are summed and lines downsampled, which both need numbers.
+    if not all(pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]) for column in y_columns):
+        return None
+    # Streamlit has no pie chart; the same data reads as a bar chart.
+    chart_type = recommendation["chart_type"] if recommendation["chart_type"] in CHART_TYPES else "bar"
+    return _recommendation(chart_type, recommendation["x_column"], y_columns, recommendation.get("title") or "")
@@ -1,7 +1,14 @@
+import argparse
+import io
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+import numpy as np
 import psycopg2
 from faker import Faker
-import random
-import os
 from dotenv import load_dotenv
 load_dotenv()
 # --- DATABASE CONNECTION DETAILS ---
@@ -13,75 +20,331 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
 # --- DATA GENERATION SETUP ---
-fake = Faker()
-NUM_DEPARTMENTS = 5
-NUM_EMPLOYEES = 50
-NUM_PRODUCTS = 100
-NUM_ORDERS = 200
-
-def populate_data():
-    """Connects to the database and populates it with fake data."""
+# Rows per table at scale factor 1 (SF=1 -> 1M orders). Without a scale factor
+# the small demo data set is generated.
+SCALE_ROWS = {"departments": 100, "employees": 10_000, "products": 50_000, "orders": 1_000_000}
+DEMO_ROWS = {"departments": 5, "employees": 50, "products": 100, "orders": 200}
+DEPARTMENTS = ['Engineering', 'Human Resources', 'Sales', 'Marketing', 'Support']
+# Distinct customers per order; customers repeat with a skewed (Zipf-like) distribution.
+CUSTOMERS_PER_ORDER = 0.2
+# Faker is only used to build these pools; rows are drawn from them with NumPy.
+NAME_POOL_SIZE = 1000
+PHRASE_POOL_SIZE = 2000
+DEFAULT_BATCH_SIZE = 100_000
+LOAD_ORDER = ["departments", "employees", "products", "orders"]
+
+def connect():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+def row_counts(scale_factor=None):
+    """Returns the number of rows to generate per table."""
+    if scale_factor is None:
+        return dict(DEMO_ROWS)
+    return {table: max(1, int(rows * scale_factor)) for table, rows in SCALE_ROWS.items()}
+
+@lru_cache(maxsize=None)
+def _pools(seed):
+    """Builds the Faker vocabularies once per process (deterministic for a seed)."""
+    fake = Faker()
+    fake.seed_instance(seed)
+    first_names = sorted({fake.first_name() for _ in range(NAME_POOL_SIZE * 3)})[:NAME_POOL_SIZE]
+    last_names = sorted({fake.last_name() for _ in range(NAME_POOL_SIZE * 3)})[:NAME_POOL_SIZE]
+    phrases = sorted({fake.catch_phrase() for _ in range(PHRASE_POOL_SIZE)})
+    return np.array(first_names, dtype=object), np.array(last_names, dtype=object), np.array(phrases, dtype=object)
+
+def _full_names(first_names, last_names, first_idx, last_idx):
+    return first_names[first_idx] + " " + last_names[last_idx]
+
+def customer_pool(size, seed):
+    """Returns `size` distinct customer names."""
+    first_names, last_names, _ = _pools(seed)
+    rng = np.random.default_rng(seed)
+    combinations = len(first_names) * len(last_names)
+    picks = rng.choice(combinations, size=min(size, combinations), replace=False)
+    names = _full_names(first_names, last_names, picks // len(last_names), picks % len(last_names))
+    if size > combinations:
+        # Beyond the first x last combinations, add a middle initial.
+        extra = np.arange(size - combinations)
+        combo = extra % combinations
+        initials = np.array([f" {chr(65 + i)}. " for i in range(26)], dtype=object)
+        names = np.concatenate([names, first_names[combo // len(last_names)] + initials[(extra // combinations) % 26]
+                                + last_names[combo % len(last_names)]])
+    return list(names)
+
+def _customer_weights(size):
+    weights = 1.0 / np.arange(1, size + 1) ** 1.1
+    return weights / weights.sum()
+
+def _copy_rows(cur, table, columns, rows):
+    """Streams one batch of rows into the table with COPY FROM STDIN."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(r"\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def _encode(texts):
+    from generate_embeddings import _vector_literal, encode_texts
+    return [_vector_literal(embedding) for embedding in encode_texts(list(texts))]
+
+def _generate(table, rng, rows, start, context, embeddings):
+    """Generates one batch of `rows` rows for a table. Returns (columns, row tuples)."""
+    first_names, last_names, phrases = _pools(context["seed"])
+    if table == "employees":
+        first_idx = rng.integers(0, len(first_names), rows)
+        last_idx = rng.integers(0, len(last_names), rows)
+        names = _full_names(first_names, last_names, first_idx, last_idx)
+        # The run id and row number keep emails unique across repeated runs.
+        emails = [
+            f"{first_names[f].lower()}.{last_names[l].lower().replace(' ', '')}.{context['run_id']}{start + i}@example.com"
+            for i, (f, l) in enumerate(zip(first_idx, last_idx))
+        ]
+        columns = ["name", "department_id", "email", "salary"]
+        values = [names, rng.choice(context["department_ids"], rows), emails, rng.integers(40000, 150001, rows)]
+        if embeddings:
+            columns.append("name_embedding")
+            values.append(_encode(names))
+        return columns, zip(*values)
+
+    if table == "products":
+        phrase_idx = rng.integers(0, len(phrases), rows)
+        # Past the phrase pool, products get a model number so names stay varied.
+        names = [
+            phrases[p] if start + i < len(phrases) else f"{phrases[p]} {(start + i) // len(phrases)}"
+            for i, p in enumerate(phrase_idx)
+        ]
+        prices = np.round(rng.uniform(10.0, 1000.0, rows), 2)
+        columns = ["name", "price"]
+        values = [names, [f"{price:.2f}" for price in prices]]
+        if embeddings:
+            columns.append("name_embedding")
+            values.append(_encode(names))
+        return columns, zip(*values)
+
+    if table == "orders":
+        customers = context["customers"]
+        customer_idx = rng.choice(len(customers), rows, p=_customer_weights(len(customers)))
+        totals = np.round(rng.uniform(50.0, 5000.0, rows), 2)
+        first_day = date(date.today().year // 10 * 10, 1, 1)
+        days = rng.integers(0, (date.today() - first_day).days + 1, rows)
+        dates = np.datetime64(first_day) + days.astype("timedelta64[D]")
+        columns = ["customer_name", "employee_id", "order_total", "order_date"]
+        values = [
+            [customers[i] for i in customer_idx],
+            rng.choice(context["employee_ids"], rows),
+            [f"{total:.2f}" for total in totals],
+            dates.astype(str),
+        ]
+        return columns, zip(*values)
+
+    raise ValueError(f"Unknown table '{table}'")
+
+def load_chunk(table, start, rows, chunk_seed, context, batch_size, embeddings):
+    """
+    Generates and COPYs `rows` rows of a table over its own connection, in
+    batches of `batch_size`. Runs in a worker process. Returns the row count.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        rng = np.random.default_rng(chunk_seed)
+        for offset in range(0, rows, batch_size):
+            size = min(batch_size, rows - offset)
+            columns, batch = _generate(table, rng, size, start + offset, context, embeddings)
+            _copy_rows(cur, table, columns, batch)
+        conn.commit()
+        cur.close()
+        return rows
+    finally:
+        conn.close()
+
+def _split(rows, parts):
+    size = -(-rows // parts)
+    return [(start, min(size, rows - start)) for start in range(0, rows, size)]
+
+def _run_parallel(pool, table, rows, workers, context, batch_size, embeddings):
+    """Submits one chunk per worker; returns the futures."""
+    return [
+        pool.submit(load_chunk, table, start, size, [context["seed"], LOAD_ORDER.index(table), start],
+                    context, batch_size, embeddings)
+        for start, size in _split(rows, workers)
+    ]
+
+def _fetch_ids(cur, table):
+    cur.execute(f"SELECT id FROM {table}")
+    return np.array([row[0] for row in cur.fetchall()])
+
+def _set_user_triggers(cur, enabled):
+    # User triggers (embedding queue per row, customer-name sync per COPY batch)
+    # would add work to every load statement. They are switched off for the bulk load, and their work is redone
+    # in bulk by _sync_customer_names and _enqueue_missing_embeddings.
+    action = "ENABLE" if enabled else "DISABLE"
+    for table in LOAD_ORDER:
+        cur.execute(f"ALTER TABLE {table} {action} TRIGGER USER")
+
+def _sync_customer_names(cur, embeddings):
+    """Re-syncs the customer_names vocabulary (sql/customer_names.sql) if it exists."""
+    cur.execute("SELECT to_regclass('customer_names') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return
+    cur.execute(
+        "INSERT INTO customer_names (name, order_count) "
+        "SELECT customer_name, count(*) FROM orders GROUP BY customer_name "
+        "ON CONFLICT (name) DO UPDATE SET order_count = EXCLUDED.order_count"
+    )
+    # Names left over from truncated or deleted orders.
+    cur.execute("DELETE FROM customer_names c WHERE NOT EXISTS (SELECT 1 FROM orders o WHERE o.customer_name = c.name)")
+    print("customer_names vocabulary synced.")
+    if not embeddings:
+        return
+    # Only distinct names are embedded, once each.
+    cur.execute("SELECT id, name FROM customer_names WHERE name_embedding IS NULL")
+    records = cur.fetchall()
+    if not records:
+        return
+    cur.execute("CREATE TEMP TABLE customer_embeddings (id INTEGER PRIMARY KEY, embedding VECTOR(384)) ON COMMIT DROP")
+    for offset in range(0, len(records), DEFAULT_BATCH_SIZE):
+        batch = records[offset:offset + DEFAULT_BATCH_SIZE]
+        _copy_rows(cur, "customer_embeddings", ["id", "embedding"],
+                   zip([rec[0] for rec in batch], _encode([rec[1] for rec in batch])))
+    cur.execute(
+        "UPDATE customer_names AS c SET name_embedding = e.embedding "
+        "FROM customer_embeddings AS e WHERE c.id = e.id"
+    )
+    print(f"{len(records)} customer-name embeddings stored.")
+
+def _enqueue_missing_embeddings(cur):
+    """
+    Queues the loaded rows without embeddings for utils/embedding_worker.py, as
+    the disabled enqueue triggers would have. Names added to customer_names are
+    queued by that table's own trigger.
+    """
+    cur.execute("SELECT to_regclass('embedding_queue') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        print("No embedding queue found: run utils/generate_embeddings.py to embed the new rows.")
+        return
+    for table in ("employees", "products"):
+        cur.execute(
+            f"INSERT INTO embedding_queue (table_name, row_id) "
+            f"SELECT %s, t.id FROM {table} t WHERE t.name_embedding IS NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM embedding_queue q WHERE q.table_name = %s AND q.row_id = t.id)",
+            (table, table),
+        )
+        queued = cur.rowcount
+        if queued:
+            cur.execute("SELECT pg_notify('embedding_queue', %s)", (table,))
+            print(f"{queued} {table} queued for embedding.")
+
+def populate_data(scale_factor=None, workers=4, batch_size=DEFAULT_BATCH_SIZE, embeddings=False,
+                  truncate=False, seed=42):
+    """
+    Generates synthetic data and bulk-loads it with COPY. Employees and products
+    load in parallel, then orders, each split across `workers` processes.
+    Foreign keys reference the ids actually present in the database.
+    """
+    counts = row_counts(scale_factor)
     conn = None
+    pool = None
+    triggers_disabled = False
     try:
         # Establish the connection
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
+        conn = connect()
         cur = conn.cursor()
         print("Database connection established.")
+        print(f"Generating {counts} (scale factor {scale_factor or 'demo'}).")
+        started = time.perf_counter()
+
+        if truncate:
+            cur.execute(f"TRUNCATE {', '.join(LOAD_ORDER)} RESTART IDENTITY CASCADE")
+        try:
+            _set_user_triggers(cur, False)
+            conn.commit()
+            triggers_disabled = True
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Could not disable triggers, loading with them enabled: {e}")
+            if truncate:
+                cur.execute(f"TRUNCATE {', '.join(LOAD_ORDER)} RESTART IDENTITY CASCADE")
+                conn.commit()
 
         # --- 1. POPULATE DEPARTMENTS ---
-        print("Populating departments...")
-        departments = ['Engineering', 'Human Resources', 'Sales', 'Marketing', 'Support']
-        for dept_name in departments:
-            cur.execute("INSERT INTO departments (name) VALUES (%s) RETURNING id", (dept_name,))
-        print(f"{len(departments)} departments populated.")
-
-        # --- 2. POPULATE EMPLOYEES ---
-        print("Populating employees...")
-        for _ in range(NUM_EMPLOYEES):
-            cur.execute(
-                "INSERT INTO employees (name, department_id, email, salary) VALUES (%s, %s, %s, %s)",
-                (fake.name(), random.randint(1, NUM_DEPARTMENTS), fake.email(), random.randint(40000, 150000))
-            )
-        print(f"{NUM_EMPLOYEES} employees populated.")
-
-        # --- 3. POPULATE PRODUCTS ---
-        print("Populating products...")
-        for _ in range(NUM_PRODUCTS):
-            cur.execute(
-                "INSERT INTO products (name, price) VALUES (%s, %s)",
-                (fake.catch_phrase(), round(random.uniform(10.0, 1000.0), 2))
-            )
-        print(f"{NUM_PRODUCTS} products populated.")
-
-        # --- 4. POPULATE ORDERS ---
-        print("Populating orders...")
-        for _ in range(NUM_ORDERS):
-            cur.execute(
-                "INSERT INTO orders (customer_name, employee_id, order_total, order_date) VALUES (%s, %s, %s, %s)",
-                (fake.name(), random.randint(1, NUM_EMPLOYEES), round(random.uniform(50.0, 5000.0), 2), fake.date_this_decade())
-            )
-        print(f"{NUM_ORDERS} orders populated.")
-
-        # Commit the changes to the database
+        names = [
+            DEPARTMENTS[i % len(DEPARTMENTS)] + ("" if i < len(DEPARTMENTS) else f" {i // len(DEPARTMENTS) + 1}")
+            for i in range(counts["departments"])
+        ]
+        _copy_rows(cur, "departments", ["name"], [(name,) for name in names])
         conn.commit()
-        print("\nData generation complete. Changes have been committed.")
+        print(f"{len(names)} departments populated.")
+
+        context = {
+            "seed": seed,
+            "run_id": uuid.uuid4().hex[:6],
+            "department_ids": _fetch_ids(cur, "departments"),
+        }
+        customers = customer_pool(max(1, int(counts["orders"] * CUSTOMERS_PER_ORDER)), seed)
+
+        # --- 2. EMPLOYEES AND PRODUCTS (in parallel), 3. ORDERS ---
+        pool = ProcessPoolExecutor(max_workers=max(1, workers))
+        employee_futures = _run_parallel(pool, "employees", counts["employees"], workers, context, batch_size, embeddings)
+        product_futures = _run_parallel(pool, "products", counts["products"], workers, context, batch_size, embeddings)
+        print(f"{sum(f.result() for f in employee_futures)} employees populated.")
+
+        context["employee_ids"] = _fetch_ids(cur, "employees")
+        context["customers"] = customers
+        order_futures = _run_parallel(pool, "orders", counts["orders"], workers, context, batch_size, False)
+        print(f"{sum(f.result() for f in product_futures)} products populated.")
+        print(f"{sum(f.result() for f in order_futures)} orders populated.")
+
+        _sync_customer_names(cur, embeddings)
+        if not embeddings:
+            _enqueue_missing_embeddings(cur)
+        conn.commit()
+
+        # Fresh statistics, so the planner (and the cost guard) see the new volumes.
+        conn.autocommit = True
+        for table in LOAD_ORDER:
+            cur.execute(f"ANALYZE {table}")
+        conn.autocommit = False
+
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        print(f"\nData generation complete: {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/sec).")
 
     except psycopg2.Error as e:
         print(f"Database error: {e}")
         if conn:
             conn.rollback() # Roll back the transaction on error
     finally:
-        # Close the connection
+        if pool:
+            pool.shutdown(cancel_futures=True)
         if conn:
-            cur.close()
+            if triggers_disabled:
+                try:
+                    conn.rollback()
+                    conn.autocommit = True
+                    _set_user_triggers(conn.cursor(), True)
+                except psycopg2.Error as e:
+                    print(f"Could not re-enable triggers (run ALTER TABLE ... ENABLE TRIGGER USER): {e}")
             conn.close()
             print("Database connection closed.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Populate the database with synthetic data.")
+    parser.add_argument("--scale-factor", type=float, help="Scale factor (1 = 1M orders). Default: small demo data set.")
+    parser.add_argument("--workers", type=int, default=4, help="Processes generating and loading each table in parallel.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per COPY batch.")
+    parser.add_argument("--embeddings", action="store_true", help="Store name embeddings in the same pass.")
+    parser.add_argument("--truncate", action="store_true", help="Empty the tables (and reset ids) before loading.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the generated vocabularies.")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    populate_data()
\ No newline at end of file
+    args = parse_args()
+    populate_data(args.scale_factor, args.workers, args.batch_size, args.embeddings, args.truncate, args.seed)
@@ -0,0 +1,154 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# Settings are read from the environment directly because this module is
+# shared by the app and the standalone scripts in utils/.
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch", "onnx", "onnx-int8" (dynamically quantized ONNX) or "openvino".
+# The non-torch backends need the sentence-transformers[onnx] or [openvino] extra.
+BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Quantized ONNX file for "onnx-int8"; chosen from the CPU's features when empty.
+ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
+# When set (e.g. http://localhost:8765), encoding is delegated to a shared
+# utils/embedding_service.py process instead of loading the model here.
+SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "10"))
+CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+EMBEDDING_DIM = 384
+
+# Quantized builds published with the sentence-transformers models, each
+# using instructions only some CPUs have.
+_ONNX_INT8_BUILDS = (
+    ("avx512_vnni", "onnx/model_qint8_avx512_vnni.onnx"),
+    ("avx512f", "onnx/model_qint8_avx512.onnx"),
+    ("avx2", "onnx/model_quint8_avx2.onnx"),
+)
+_ONNX_INT8_ARM = "onnx/model_qint8_arm64.onnx"
+
+def _onnx_int8_file():
+    if ONNX_INT8_FILE:
+        return ONNX_INT8_FILE
+    import platform
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return _ONNX_INT8_ARM
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(next((line for line in f if line.startswith("flags")), "").split())
+    except OSError:
+        flags = set()
+    for flag, file_name in _ONNX_INT8_BUILDS:
+        if flag in flags:
+            return file_name
+    # Unknown CPU features (e.g. macOS on Intel): AVX2 is the most widely supported.
+    return _ONNX_INT8_BUILDS[-1][1]
+
+_model = None
+_model_lock = threading.Lock()
+_session = None
+
+# (text, normalized) -> float32 vector
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+def get_model():
+    """Loads the sentence-transformer on first use with the configured backend."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                print(f"Loading embedding model '{MODEL_NAME}' ({BACKEND} backend)...")
+                if BACKEND == "onnx-int8":
+                    file_name = _onnx_int8_file()
+                    print(f"Using quantized ONNX file '{file_name}'.")
+                    _model = SentenceTransformer(MODEL_NAME, backend="onnx", model_kwargs={"file_name": file_name})
+                elif BACKEND in ("onnx", "openvino"):
+                    _model = SentenceTransformer(MODEL_NAME, backend=BACKEND)
+                else:
+                    _model = SentenceTransformer(MODEL_NAME)
+                print("Embedding model loaded.")
+    return _model
+
+def _encode_remote(texts, normalize_embeddings):
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    response = _session.post(
+        f"{SERVICE_URL.rstrip('/')}/encode",
+        json={"texts": texts, "normalize": normalize_embeddings},
+        timeout=SERVICE_TIMEOUT,
+    )
+    response.raise_for_status()
+    # The service answers with raw little-endian float32 rows.
+    return np.frombuffer(response.content, dtype="<f4").reshape(len(texts), -1)
+
+def _encode_uncached(texts, normalize_embeddings, batch_size, use_service=True):
+    if SERVICE_URL and use_service:
+        return _encode_remote(texts, normalize_embeddings)
+    embeddings = get_model().encode(
+        texts, batch_size=batch_size, normalize_embeddings=normalize_embeddings, show_progress_bar=False
+    )
+    return np.asarray(embeddings, dtype=np.float32)
+
+def encode(texts, normalize_embeddings=False, batch_size=64, use_cache=True, use_service=True):
+    """
+    Encodes a string (returns a 1-D float32 vector) or a list of strings
+    (returns a 2-D float32 array). Results for short query strings are kept in
+    an LRU cache; pass use_cache=False for bulk jobs.
+    """
+    single = isinstance(texts, str)
+    texts = [texts] if single else list(texts)
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    if not use_cache or CACHE_SIZE <= 0:
+        embeddings = _encode_uncached(texts, normalize_embeddings, batch_size, use_service)
+        return embeddings[0] if single else embeddings
+
+    results = [None] * len(texts)
+    missing = {}
+    with _cache_lock:
+        for i, text in enumerate(texts):
+            cached = _cache.get((text, normalize_embeddings))
+            if cached is not None:
+                _cache.move_to_end((text, normalize_embeddings))
+                results[i] = cached
+                _stats["hits"] += 1
+            else:
+                missing.setdefault(text, []).append(i)
+                _stats["misses"] += 1
+
+    if missing:
+        computed = _encode_uncached(list(missing), normalize_embeddings, batch_size, use_service)
+        with _cache_lock:
+            for text, embedding in zip(missing, computed):
+                for i in missing[text]:
+                    results[i] = embedding
+                _cache[(text, normalize_embeddings)] = embedding
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return results[0] if single else np.stack(results)
+
+def warm_up():
+    """Loads the model (or checks the service) ahead of the first request."""
+    if SERVICE_URL:
+        encode("warm up", use_cache=False)
+    else:
+        get_model()
+
+def get_stats():
+    """Returns cache hit/miss counters and the configured backend."""
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["cached_strings"] = len(_cache)
+    stats["backend"] = f"service ({SERVICE_URL})" if SERVICE_URL else BACKEND
+    stats["model_loaded"] = _model is not None
+    return stats
@@ -0,0 +1,62 @@
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import embedding_provider
+
+# A small local HTTP service that loads the embedding model once and serves
+# every app worker on the node. Point workers at it with EMBEDDING_SERVICE_URL.
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        body = json.dumps(embedding_provider.get_stats()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/encode":
+            self.send_error(404)
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = payload["texts"]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+            embeddings = embedding_provider.encode(
+                texts, normalize_embeddings=bool(payload.get("normalize")), use_service=False
+            )
+        except (ValueError, KeyError) as e:
+            self.send_error(400, str(e))
+            return
+
+        body = embeddings.astype("<f4").tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve sentence-transformer embeddings to local app workers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    embedding_provider.get_model()
+    server = ThreadingHTTPServer((args.host, args.port), EmbeddingHandler)
+    print(f"Embedding service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping embedding service.")
+        server.server_close()
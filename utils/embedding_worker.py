@@ -0,0 +1,133 @@
+import argparse
+import os
+import select
+import time
+import psycopg2
+from dotenv import load_dotenv
+import embedding_provider
+from generate_embeddings import TABLES_TO_PROCESS, encode_texts, write_embeddings
+load_dotenv()
+# --- DATABASE CONNECTION DETAILS ---
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+
+# --- WORKER SETTINGS ---
+CHANNEL = "embedding_queue"
+DEFAULT_BATCH_SIZE = 256
+# How long to keep collecting notifications before processing a micro-batch.
+DEFAULT_BATCH_WINDOW = 0.2
+# Poll the queue even without notifications (e.g. rows queued while the worker was down).
+DEFAULT_POLL_INTERVAL = 30.0
+
+CLAIM_SQL = """
+    WITH batch AS (
+        SELECT id FROM embedding_queue ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM embedding_queue AS q USING batch
+    WHERE q.id = batch.id
+    RETURNING q.table_name, q.row_id
+"""
+
+def process_batch(conn, batch_size):
+    """
+    Claims up to `batch_size` queued rows, embeds their current text and writes
+    the embeddings back. The claim and the writes commit together, so a crash
+    leaves the entries queued. Returns the number of queue entries processed.
+    """
+    cur = conn.cursor()
+    cur.execute(CLAIM_SQL, (batch_size,))
+    claimed = cur.fetchall()
+
+    ids_by_table = {}
+    for table_name, row_id in claimed:
+        if table_name in TABLES_TO_PROCESS:
+            ids_by_table.setdefault(table_name, set()).add(row_id)
+
+    for table_name, row_ids in ids_by_table.items():
+        text_col, embedding_col = TABLES_TO_PROCESS[table_name]
+        # Rows deleted since they were queued simply aren't returned.
+        cur.execute(f"SELECT id, {text_col} FROM {table_name} WHERE id = ANY(%s)", (list(row_ids),))
+        records = cur.fetchall()
+        if records:
+            embeddings = encode_texts([rec[1] for rec in records])
+            write_embeddings(cur, table_name, embedding_col, [rec[0] for rec in records], embeddings)
+
+    conn.commit()
+    cur.close()
+    return len(claimed)
+
+def drain_queue(conn, batch_size):
+    """Processes micro-batches until the queue is empty."""
+    total, started = 0, time.perf_counter()
+    while True:
+        processed = process_batch(conn, batch_size)
+        total += processed
+        if processed < batch_size:
+            break
+    if total:
+        elapsed = time.perf_counter() - started
+        print(f"Embedded {total} queued rows in {elapsed:.2f}s ({total / elapsed:.0f} rows/sec).")
+    return total
+
+def run_worker(batch_size=DEFAULT_BATCH_SIZE, batch_window=DEFAULT_BATCH_WINDOW, poll_interval=DEFAULT_POLL_INTERVAL):
+    """Listens for queue notifications and keeps embeddings up to date."""
+    conn = psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+    print("Database connection established.")
+    embedding_provider.warm_up()
+
+    # LISTEN runs on its own autocommit connection so notifications arrive
+    # while the work connection is inside a transaction.
+    listen_conn = psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+    listen_conn.autocommit = True
+    listen_conn.cursor().execute(f"LISTEN {CHANNEL}")
+
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS embedding_updates (id BIGINT PRIMARY KEY, embedding VECTOR(384))")
+    conn.commit()
+    cur.close()
+
+    print(f"Listening on '{CHANNEL}'. Press Ctrl+C to stop.")
+    try:
+        drain_queue(conn, batch_size)
+        while True:
+            if select.select([listen_conn], [], [], poll_interval) != ([], [], []):
+                # Give concurrent writers a moment so their rows land in the same micro-batch.
+                time.sleep(batch_window)
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+            drain_queue(conn, batch_size)
+    except KeyboardInterrupt:
+        print("Stopping embedding worker.")
+    except psycopg2.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+    finally:
+        listen_conn.close()
+        conn.close()
+        print("Database connection closed.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Keep embeddings fresh from the embedding_queue table.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Queue entries processed per transaction.")
+    parser.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW, help="Seconds to gather changes before embedding them.")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between queue polls without notifications.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_worker(args.batch_size, args.batch_window, args.poll_interval)
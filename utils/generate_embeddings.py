@@ -1,6 +1,11 @@
-import psycopg2
-from sentence_transformers import SentenceTransformer
+import argparse
+import io
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import psycopg2
+import embedding_provider
 from dotenv import load_dotenv
 load_dotenv()
 # --- DATABASE CONNECTION DETAILS ---
@@ -10,16 +15,117 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
+# --- TABLES TO PROCESS ---
+TABLES_TO_PROCESS = {
+    "products": ("name", "name_embedding"),
+    "employees": ("name", "name_embedding"),
+    # One row per distinct customer name (sql/customer_names.sql), not per order.
+    "customer_names": ("name", "name_embedding")
+}
+
+# --- BACKFILL DEFAULTS ---
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".embedding_checkpoint.json")
+
 # --- EMBEDDING MODEL SETUP ---
-# This line downloads a pre-trained model.
+# The shared provider loads the model on first use (once per process, including
+# pool workers), or delegates to the embedding service if one is configured.
+def encode_texts(texts):
+    """Encodes a list of strings into float32 embeddings."""
+    return embedding_provider.encode(texts, use_cache=False)
+
+def encode_batch(texts, pool=None, workers=0):
+    """Encodes a batch, splitting it across the process pool when one is given."""
+    if pool is None or workers <= 1 or len(texts) < workers:
+        return list(encode_texts(texts))
+    chunk_size = -(-len(texts) // workers)
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    return [embedding for chunk in pool.map(encode_texts, chunks) for embedding in chunk]
+
+def _vector_literal(embedding):
+    return "[" + ",".join(f"{value:.7g}" for value in embedding) + "]"
+
+def write_embeddings(cur, table_name, embedding_col, ids, embeddings):
+    """
+    Bulk-writes a batch: COPY into a temporary table, then one UPDATE ... FROM.
+    """
+    buffer = io.StringIO()
+    for record_id, embedding in zip(ids, embeddings):
+        buffer.write(f"{record_id}\t{_vector_literal(embedding)}\n")
+    buffer.seek(0)
+
+    cur.execute("TRUNCATE embedding_updates")
+    cur.copy_expert("COPY embedding_updates (id, embedding) FROM STDIN", buffer)
+    cur.execute(
+        f"UPDATE {table_name} AS t SET {embedding_col} = u.embedding "
+        f"FROM embedding_updates AS u WHERE t.id = u.id"
+    )
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
 
-print("Loading sentence transformer model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Model loaded.")
+def backfill_table(conn, table_name, text_col, embedding_col, batch_size, checkpoint, checkpoint_file, pool=None, workers=0):
+    """
+    Embeds every row of one table whose embedding is NULL, paging by id.
+    Each batch is committed on its own, and the last committed id is saved
+    so an interrupted run resumes where it stopped.
+    """
+    cur = conn.cursor()
+    last_id = checkpoint.get(table_name, 0)
+    if last_id:
+        print(f"Resuming {table_name} after id {last_id}.")
 
-def generate_and_store_embeddings():
+    total, started = 0, time.perf_counter()
+    while True:
+        cur.execute(
+            f"SELECT id, {text_col} FROM {table_name} "
+            f"WHERE {embedding_col} IS NULL AND id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        records = cur.fetchall()
+        if not records:
+            break
+
+        ids = [rec[0] for rec in records]
+        texts = [rec[1] for rec in records]
+        embeddings = encode_batch(texts, pool, workers)
+        write_embeddings(cur, table_name, embedding_col, ids, embeddings)
+        conn.commit()
+
+        last_id = ids[-1]
+        checkpoint[table_name] = last_id
+        save_checkpoint(checkpoint_file, checkpoint)
+
+        total += len(ids)
+        elapsed = time.perf_counter() - started
+        print(f"{table_name}: {total} rows embedded (last id {last_id}), {total / elapsed:.0f} rows/sec")
+
+    cur.close()
+    if total:
+        elapsed = time.perf_counter() - started
+        print(f"Finished {table_name}: {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/sec).")
+    else:
+        print(f"No new records to embed in {table_name}.")
+    # A finished table starts from the beginning next time, to pick up new rows.
+    checkpoint.pop(table_name, None)
+    save_checkpoint(checkpoint_file, checkpoint)
+    return total
+
+def generate_and_store_embeddings(tables=None, batch_size=DEFAULT_BATCH_SIZE, workers=0,
+                                  checkpoint_file=DEFAULT_CHECKPOINT_FILE, reset=False):
     """Fetches data, generates embeddings, and stores them in the database."""
     conn = None
+    pool = None
     try:
         conn = psycopg2.connect(
             dbname=DB_NAME,
@@ -31,47 +137,23 @@ def generate_and_store_embeddings():
         cur = conn.cursor()
         print("Database connection established.")
 
-        # --- TABLES TO PROCESS ---
-        tables_to_process = {
-            "products": ("name", "name_embedding"),
-            "employees": ("name", "name_embedding"),
-            "orders": ("customer_name", "customer_name_embedding")
-        }
+        # Rows are staged here before the per-batch UPDATE ... FROM.
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS embedding_updates (id BIGINT PRIMARY KEY, embedding VECTOR(384))")
+        conn.commit()
+        cur.close()
+
+        checkpoint = {} if reset else load_checkpoint(checkpoint_file)
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            embedding_provider.warm_up()
 
-        for table_name, (text_col, embedding_col) in tables_to_process.items():
+        for table_name in tables or TABLES_TO_PROCESS:
+            text_col, embedding_col = TABLES_TO_PROCESS[table_name]
             print(f"\n--- Processing table: {table_name} ---")
+            backfill_table(conn, table_name, text_col, embedding_col, batch_size,
+                           checkpoint, checkpoint_file, pool, workers)
 
-            # 1. Fetch records that don't have an embedding yet
-            cur.execute(f"SELECT id, {text_col} FROM {table_name} WHERE {embedding_col} IS NULL")
-            records = cur.fetchall()
-
-            if not records:
-                print(f"No new records to embed in {table_name}.")
-                continue
-
-            print(f"Found {len(records)} records to embed.")
-            
-            # Extract IDs and texts for batch processing
-            ids = [rec[0] for rec in records]
-            texts = [rec[1] for rec in records]
-
-            # 2. Generate embeddings in a batch (much more efficient)
-            print("Generating embeddings...")
-            embeddings = model.encode(texts, show_progress_bar=True)
-
-            # 3. Update the database with the new embeddings
-            print("Updating database with embeddings...")
-            for i, record_id in enumerate(ids):
-                embedding = embeddings[i].tolist()
-                cur.execute(
-                    f"UPDATE {table_name} SET {embedding_col} = %s WHERE id = %s",
-                    (embedding, record_id)
-                )
-            
-            print(f"Successfully updated {len(ids)} records in {table_name}.")
-
-        # Commit all changes
-        conn.commit()
         print("\nAll embeddings generated and stored successfully.")
 
     except psycopg2.Error as e:
@@ -79,10 +161,21 @@ def generate_and_store_embeddings():
         if conn:
             conn.rollback()
     finally:
+        if pool:
+            pool.shutdown()
         if conn:
-            cur.close()
             conn.close()
             print("Database connection closed.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill embeddings for rows that don't have one yet.")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES_TO_PROCESS), help="Tables to process (default: all).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows fetched, encoded and committed per batch.")
+    parser.add_argument("--workers", type=int, default=0, help="Encode with a pool of this many processes (0 = in-process).")
+    parser.add_argument("--checkpoint-file", default=DEFAULT_CHECKPOINT_FILE, help="Where resume positions are stored.")
+    parser.add_argument("--reset", action="store_true", help="Ignore any saved checkpoint.")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    generate_and_store_embeddings()
\ No newline at end of file
+    args = parse_args()
+    generate_and_store_embeddings(args.tables, args.batch_size, args.workers, args.checkpoint_file, args.reset)
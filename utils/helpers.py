@@ -1,15 +1,28 @@
+import os
 import re
-import streamlit as st
-import pandas as pd
-import openai
 import json
+from typing import TYPE_CHECKING
+import streamlit as st
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
+def _strip_vector_columns(schema_sql: str):
+    """
+    Removes vector (embedding) columns from the schema text. The model should
+    never select them: they are large and only used for similarity search.
+    """
+    schema_sql = re.sub(r"ALTER TABLE\s+\w+\s+ADD COLUMN\s+\w+\s+VECTOR\s*\(\d+\)\s*;\s*", "", schema_sql, flags=re.IGNORECASE)
+    return re.sub(r"^\s*\w+\s+VECTOR\s*\(\d+\)\s*,?\s*\n", "", schema_sql, flags=re.IGNORECASE | re.MULTILINE)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql", "schema.sql")
+
 def get_schema_definition():
-    """Reads the database schema from the SQL file."""
+    """Reads the database schema from the SQL file, without vector columns."""
     try:
-        with open('sql/schema.sql', 'r') as f:
-            return f.read()
+        with open(SCHEMA_FILE, 'r') as f:
+            return _strip_vector_columns(f.read())
     except FileNotFoundError:
         return "Error: Could not find schema.sql file."
 
@@ -22,11 +35,21 @@ def extract_sql_from_response(response_text: str):
     if match:
         return match.group(1).strip()
 
+    # A streamed response may be cut off before the closing fence
+    match = re.search(r"```(?:sql)?\s*(.*?)\s*(?:```|$)", response_text, re.DOTALL)
+    if match:
+        return match.group(1).strip()
+
+    # Skip any prose before a line starting with SELECT or WITH
+    match = re.search(r"^[ \t]*(?:select|with)\b.*", response_text, re.DOTALL | re.IGNORECASE | re.MULTILINE)
+    if match:
+        return match.group(0).strip()
+
     # If no markdown block, assume the whole response is the query
     return response_text.strip()
 
 
-def get_ai_chart_recommendation(df: pd.DataFrame, user_question: str):
+def get_ai_chart_recommendation(df: "pd.DataFrame", user_question: str):
     """
     Asks an LLM to recommend the best chart type and columns for the given data.
     """
@@ -55,6 +78,8 @@ def get_ai_chart_recommendation(df: pd.DataFrame, user_question: str):
     """
     
     try:
+        # Imported on first use to keep it off the app's startup path.
+        import openai
         response = openai.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
@@ -67,37 +92,48 @@ def get_ai_chart_recommendation(df: pd.DataFrame, user_question: str):
         return {"chart_type": "none"}
 
 # --- UPDATED: Main Chart Display Function ---
-def display_intelligent_chart(df: pd.DataFrame, user_question: str):
+def display_intelligent_chart(df: "pd.DataFrame", user_question: str, result_id: str = None):
     """
-    Gets an AI recommendation and displays the most appropriate chart.
+    Recommends a chart from the data's column types (asking the LLM only when
+    no rule fits) and displays it, downsampled for large results.
     """
+    # Imported on first use to keep pandas off the app's startup path.
+    from config import settings
+    from utils import chart_recommender, tracing
+
     st.write("---")
     st.markdown("#### Data Visualization")
 
-    recommendation = get_ai_chart_recommendation(df, user_question)
-    chart_type = recommendation.get("chart_type")
-    x_col = recommendation.get("x_column")
-    y_col = recommendation.get("y_column")
-    title = recommendation.get("title")
+    try:
+        with tracing.span("chart", rows=len(df)) as span:
+            llm_fallback = get_ai_chart_recommendation if settings.CHART_LLM_FALLBACK else None
+            recommendation, chart_df, source = chart_recommender.get_chart(df, user_question, llm_fallback, result_id)
+            span["source"] = source
+    except Exception as e:
+        st.error(f"Failed to create chart: {e}")
+        return
 
-    if chart_type == 'none' or not x_col or not y_col:
+    if recommendation is None:
         st.warning("Could not determine a suitable chart type for this data.")
         return
 
-    st.info(f"💡 AI Recommendation: A **{chart_type.replace('_', ' ')} chart** is best for this data.")
-    st.subheader(title)
+    chart_type = recommendation["chart_type"]
+    x_col = recommendation["x_column"]
+    y_col = recommendation["y_column"]
+    label = "AI Recommendation" if source == "llm" else "Recommendation"
+    st.info(f"💡 {label}: A **{chart_type.replace('_', ' ')} chart** is best for this data.")
+    st.subheader(recommendation["title"])
+    if chart_type == 'bar' and len(chart_df) < len(df):
+        st.caption(f"Summed {len(df):,} rows into {len(chart_df):,} bars.")
+    elif len(chart_df) < len(df):
+        st.caption(f"Showing {len(chart_df):,} of {len(df):,} rows, downsampled for display.")
 
     try:
-        # Set the index for charting
-        chart_df = df.set_index(x_col)
-
         if chart_type == 'bar':
-            st.bar_chart(chart_df[y_col])
+            st.bar_chart(chart_df, x=x_col, y=y_col)
         elif chart_type == 'line':
-            st.line_chart(chart_df[y_col])
-        elif chart_type == 'pie':
-            st.pie_chart(chart_df[y_col])
+            st.line_chart(chart_df, x=x_col, y=y_col)
         elif chart_type == 'scatter':
-            st.scatter_chart(df, x=x_col, y=y_col)
+            st.scatter_chart(chart_df, x=x_col, y=y_col)
     except Exception as e:
         st.error(f"Failed to create chart: {e}")
@@ -0,0 +1,97 @@
+import importlib.abc
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Import-time breakdown of the first run in this process, plus named warm-up
+# phases. Both persist across Streamlit reruns because modules are cached.
+_process_started = time.perf_counter()
+_imports = []   # (module, seconds including submodules, nesting depth)
+_phases = []    # (phase, seconds)
+_depth = threading.local()
+_lock = threading.Lock()
+_finder = None
+_installed = False
+
+class _TimedLoader:
+    """Wraps a loader so exec_module is timed, then restores the real loader on the module."""
+
+    def __init__(self, loader, name):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        depth = getattr(_depth, "value", 0)
+        _depth.value = depth + 1
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _depth.value = depth
+            with _lock:
+                _imports.append((self._name, time.perf_counter() - start, depth))
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, fullname)
+                return spec
+        return None
+
+def install():
+    """
+    Starts recording how long each newly imported module takes. Only the first
+    call per process does anything, so Streamlit reruns (and calls after
+    uninstall()) don't hook imports again.
+    """
+    global _finder, _installed
+    with _lock:
+        if _installed:
+            return
+        _installed = True
+        _finder = _TimingFinder()
+        sys.meta_path.insert(0, _finder)
+
+def uninstall():
+    """Stops recording imports."""
+    global _finder
+    if _finder is not None:
+        sys.meta_path.remove(_finder)
+        _finder = None
+
+@contextmanager
+def phase(name: str):
+    """Times a named startup phase (e.g. a warm-up step)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phases.append((name, time.perf_counter() - start))
+
+def get_report(top: int = 15):
+    """Returns the slowest top-level imports and every recorded phase, in milliseconds."""
+    with _lock:
+        top_level = sorted((entry for entry in _imports if entry[2] == 0), key=lambda entry: -entry[1])
+        phases = list(_phases)
+    return {
+        "seconds_since_process_start": round(time.perf_counter() - _process_started, 2),
+        "imports_ms": {name: round(seconds * 1000, 1) for name, seconds, _ in top_level[:top]},
+        "total_import_ms": round(sum(seconds for _, seconds, _ in top_level) * 1000, 1),
+        "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases},
+    }
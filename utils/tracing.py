@@ -0,0 +1,195 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-request traces and process-wide Prometheus metrics for the query pipeline.
+#
+# A trace is started per question with `trace()`. Every `span()` opened while it
+# is active, including in asyncio tasks and `asyncio.to_thread` calls that copy
+# the context, is added to it. Spans are recorded as histograms whether or not a
+# trace is active.
+
+# Histogram buckets in seconds, from a cache hit to a slow LLM call.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar("trace", default=None)
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_server_started = False
+
+class Trace:
+    """Spans and attributes (token counts, cache hits) recorded for one request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.ended_at = None
+        self.spans = []
+        self.attributes = {}
+
+    def to_dict(self):
+        end = self.ended_at or time.perf_counter()
+        return {
+            "name": self.name,
+            "total_ms": round((end - self.started_at) * 1000, 1),
+            **self.attributes,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+def current():
+    """Returns the active trace, or None."""
+    return _current.get()
+
+@contextmanager
+def trace(name: str):
+    """Starts a request trace; yields the Trace."""
+    request_trace = Trace(name)
+    token = _current.set(request_trace)
+    status = "ok"
+    try:
+        yield request_trace
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        request_trace.ended_at = time.perf_counter()
+        observe("nlsql_request_duration_seconds", request_trace.ended_at - request_trace.started_at, name=name)
+        count("nlsql_requests_total", name=name, status=status)
+
+@contextmanager
+def use(request_trace):
+    """Makes an existing trace active, e.g. on the async pipeline's event-loop thread."""
+    token = _current.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Times a pipeline stage. Yields a dict; keys added to it (rows, tokens, cache
+    hits) are stored on the span.
+    """
+    start = time.perf_counter()
+    record = dict(attributes)
+    try:
+        yield record
+    except Exception:
+        record["error"] = True
+        count("nlsql_stage_errors_total", stage=stage)
+        raise
+    finally:
+        end = time.perf_counter()
+        observe("nlsql_stage_duration_seconds", end - start, stage=stage)
+        request_trace = _current.get()
+        if request_trace is not None:
+            request_trace.spans.append({
+                "stage": stage,
+                "start_ms": round((start - request_trace.started_at) * 1000, 1),
+                "end_ms": round((end - request_trace.started_at) * 1000, 1),
+                "duration_ms": round((end - start) * 1000, 1),
+                **record,
+            })
+
+def annotate(**attributes):
+    """Adds attributes to the active trace, if any."""
+    request_trace = _current.get()
+    if request_trace is not None:
+        request_trace.attributes.update(attributes)
+
+def record_cache(cache: str, hit: bool):
+    count("nlsql_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+    annotate(**{f"{cache}_cache_hit": hit})
+
+def record_tokens(stage: str, usage):
+    """Counts the prompt/completion tokens of an OpenAI response's `usage`."""
+    if usage is None:
+        return
+    tokens = {"prompt": usage.prompt_tokens, "completion": usage.completion_tokens}
+    for kind, value in tokens.items():
+        count("nlsql_llm_tokens_total", value, stage=stage, type=kind)
+    request_trace = _current.get()
+    if request_trace is not None:
+        totals = request_trace.attributes.setdefault("tokens", {})
+        for kind, value in tokens.items():
+            totals[kind] = totals.get(kind, 0) + value
+
+def _key(metric: str, labels: dict):
+    return metric, tuple(sorted(labels.items()))
+
+def count(metric: str, value: float = 1, **labels):
+    with _lock:
+        key = _key(metric, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(metric: str, value: float, **labels):
+    with _lock:
+        key = _key(metric, labels)
+        histogram = _histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for position, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][position] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def render_metrics():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in _counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(_counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket in zip(BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {bucket}")
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {round(histogram['sum'], 6)}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Serves /metrics on a daemon thread. Only the first call per process starts it."""
+    global _server_started
+    with _lock:
+        if _server_started:
+            return
+        _server_started = True
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Could not start metrics endpoint on port {port}: {e}")
+        return
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics endpoint listening on http://{host}:{port}/metrics")